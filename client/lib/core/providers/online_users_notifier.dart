@@ -8,7 +8,7 @@ part 'online_users_notifier.g.dart';
 // Here’s what typically happens in a Riverpod and socket-based architecture:
 
 // 1. The backend sends data via the socket.
-// 2. The socket layer listens to events (join, leave).
+// 2. The socket layer listens to events (join, presence, leave).
 // 3. The socket processes and cleans the data (e.g., filtering out invalid users).
 // 4. The socket forwards the cleaned data to Riverpod.
 // 5. Riverpod updates its state provider (e.g., onlineUsersProvider).
@@ -32,6 +32,13 @@ class OnlineUsersNotifier extends _$OnlineUsersNotifier {
       _updateOnlineUsers();
     });
 
+    _socketSingleton.socket?.on('presence', (data) {
+      _updateOnlineUsers();
+    });
+
+    // Later presence pages arrive as acks rather than events
+    _socketSingleton.onOnlineUsersChanged = _updateOnlineUsers;
+
     // ref.onDispose(() {
     //   // Clean up socket listeners when the notifier is disposed
     //   _socketSingleton.socket?.off('join');
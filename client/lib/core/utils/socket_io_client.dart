@@ -19,8 +19,10 @@ class SocketSingleton {
   IO.Socket? socket;
   final List<String> onlineUsers = [];
   String? currentUserId;
+  // Called when onlineUsers changes outside a socket event (presence pages)
+  void Function()? onOnlineUsersChanged;
 
-  void initSocket(String userId) {
+  void initSocket(String userId, String token) {
     currentUserId = userId;
     socket = getSocket();
 
@@ -28,24 +30,27 @@ class SocketSingleton {
 
     socket!.on('connect', (_) {
       Debug.print("socket_io_client", 'Connected to socket server');
-      socket!.emit('login', {'user_id': userId});
+      socket!.emit('login', {'user_id': userId, 'token': token});
       Debug.print("socket_io_client", 'User ID sent: $userId');
     });
 
+    // First page of our matches' presence, sent once after login
     socket!.on("join", (data) {
-      final onlineUsersData = data["online_users"];
+      onlineUsers.clear();
+      _addPresencePage(data);
+    });
 
-      if (onlineUsersData is Map) {
-        final filteredOnlineUsers = onlineUsersData.entries
-            .where((entry) => entry.value["status"] == "ONLINE")
-            .map((entry) => entry.key as String)
-            .toList();
+    // A match came online or went offline
+    socket!.on("presence", (data) {
+      final userId = data['user_id'] as String?;
+      if (userId == null) return;
 
-        onlineUsers
-          ..clear()
-          ..addAll(filteredOnlineUsers);
+      if (data['status'] == 'ONLINE') {
+        if (!onlineUsers.contains(userId)) onlineUsers.add(userId);
+      } else {
+        onlineUsers.remove(userId);
       }
-      Debug.print("socket_io_client", "Online users updated: $onlineUsers");
+      Debug.print("socket_io_client", "Presence of $userId: ${data['status']}");
     });
 
     socket!.on("leave", (data) {
@@ -63,6 +68,32 @@ class SocketSingleton {
     });
   }
 
+  void _addPresencePage(dynamic data) {
+    final onlineUsersData = data["online_users"];
+
+    if (onlineUsersData is Map) {
+      final filteredOnlineUsers = onlineUsersData.entries
+          .where((entry) => entry.value["status"] == "ONLINE")
+          .map((entry) => entry.key as String)
+          .where((userId) => !onlineUsers.contains(userId))
+          .toList();
+
+      onlineUsers.addAll(filteredOnlineUsers);
+    }
+    Debug.print("socket_io_client", "Online users updated: $onlineUsers");
+
+    // Fetch the remaining pages one at a time
+    if (data["has_more"] == true) {
+      socket!.emitWithAck('presence_snapshot', {'page': data["page"] + 1},
+          ack: (response) {
+        if (response is Map && response["error"] == null) {
+          _addPresencePage(response);
+          onOnlineUsersChanged?.call();
+        }
+      });
+    }
+  }
+
   void disconnect() {
     if (socket != null && socket!.connected) {
       socket!.emit('logout', {'user_id': currentUserId});
@@ -39,7 +39,7 @@ class _MainNavigationPageState extends ConsumerState<MainNavigationPage> {
       final currentUser = ref.read(currentUserNotifierProvider);
 
       if (currentUser != null) {
-        SocketSingleton.instance.initSocket(currentUser.id);
+        SocketSingleton.instance.initSocket(currentUser.id, currentUser.token);
       }
       ref.read(assetViewmodelProvider.notifier).getUserAsset();
     });
@@ -1,6 +1,11 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
 
@@ -12,6 +17,21 @@ db_uri = os.getenv('DB_URI')
 engine = create_engine(db_uri)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_db_uri(uri: str):
+    # Same database through asyncpg, which spells libpq's sslmode as ssl
+    url = make_url(uri).set(drivername='postgresql+asyncpg')
+    if 'sslmode' in url.query:
+        url = url.update_query_dict({'ssl': url.query['sslmode']}).difference_update_query(['sslmode'])
+    return url
+
+
+# Async engine for the hot routes: requests wait on its connection pool
+# instead of holding one of Starlette's threadpool slots
+async_engine = create_async_engine(_async_db_uri(db_uri))
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -19,10 +39,26 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 @contextmanager
 def get_db_socket():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Blocking DB work from async code (socket handlers) runs on this pool instead
+# of the event loop. Bounded to the engine's connection pool (5 + 10 overflow
+# by default) so queued work waits here rather than for a connection.
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 15))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
@@ -1,4 +1,6 @@
 import redis
+import redis.asyncio
+from urllib.parse import quote
 from dotenv import load_dotenv
 import os
 
@@ -19,3 +21,29 @@ redis_client = redis.Redis(
     password=password,
     decode_responses=True
 )
+
+# Raw bytes client for binary values such as bitmaps
+redis_binary_client = redis.Redis(
+    host=host,
+    port=port,
+    username=username,
+    password=password,
+    decode_responses=False
+)
+
+# asyncio client for code running on the event loop (socket handlers)
+async_redis_client = redis.asyncio.Redis(
+    host=host,
+    port=port,
+    username=username,
+    password=password,
+    decode_responses=True
+)
+
+
+def redis_url() -> str:
+    # Same server as the clients above, as a URL for libraries that want one
+    credentials = ""
+    if username or password:
+        credentials = f"{quote(username or '')}:{quote(password or '')}@"
+    return f"redis://{credentials}{host or 'localhost'}:{port or 6379}/0"
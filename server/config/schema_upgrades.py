@@ -0,0 +1,81 @@
+from sqlalchemy import text
+
+from models.base import Base
+
+# Idempotent DDL for tables that already exist, since create_all only creates
+# missing tables. Statements run in order on every startup.
+SCHEMA_UPGRADES = [
+    # Canonical (min id, max id) key for matches
+    "ALTER TABLE matches ADD COLUMN IF NOT EXISTS pair_key TEXT",
+    """UPDATE matches
+       SET pair_key = LEAST(user1_id COLLATE "C", user2_id COLLATE "C")
+                      || ':' || GREATEST(user1_id COLLATE "C", user2_id COLLATE "C")
+       WHERE pair_key IS NULL""",
+    "ALTER TABLE matches ALTER COLUMN pair_key SET NOT NULL",
+    # Older writes could leave several rows for one pair, which would fail the
+    # unique ux_matches_pair_key index. Before it exists, keep one row per pair
+    # (ACTIVE, then REJECTED, then the oldest) and move messages onto it.
+    """DO $$
+       BEGIN
+           IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'ux_matches_pair_key') THEN
+               CREATE TEMP TABLE duplicate_matches ON COMMIT DROP AS
+               SELECT id, keep_id FROM (
+                   SELECT id, first_value(id) OVER (
+                       PARTITION BY pair_key
+                       ORDER BY CASE status WHEN 'ACTIVE' THEN 0 WHEN 'REJECTED' THEN 1 ELSE 2 END,
+                                created_at, id
+                   ) AS keep_id
+                   FROM matches
+               ) ranked
+               WHERE id <> keep_id;
+
+               UPDATE messages SET match_id = d.keep_id
+               FROM duplicate_matches d WHERE messages.match_id = d.id;
+               DELETE FROM conversations USING duplicate_matches d
+               WHERE conversations.match_id = d.id;
+               DELETE FROM matches USING duplicate_matches d WHERE matches.id = d.id;
+           END IF;
+       END $$""",
+    # Seed conversation summaries from existing messages the first time
+    """INSERT INTO conversations (
+           match_id, user1_id, user2_id, last_message_id, last_message_preview,
+           last_message_sender_id, last_message_at, user1_unread_count,
+           user2_unread_count, updated_at)
+       SELECT DISTINCT ON (m.match_id)
+           m.match_id, ma.user1_id, ma.user2_id, m.id, LEFT(m.content, 200),
+           m.sender_id, m.created_at,
+           (SELECT count(*) FROM messages u
+            WHERE u.match_id = m.match_id AND u.recipient_id = ma.user1_id AND NOT u.seen),
+           (SELECT count(*) FROM messages u
+            WHERE u.match_id = m.match_id AND u.recipient_id = ma.user2_id AND NOT u.seen),
+           now()
+       FROM messages m JOIN matches ma ON ma.id = m.match_id
+       WHERE NOT EXISTS (SELECT 1 FROM conversations)
+       ORDER BY m.match_id, m.created_at DESC, m.id DESC
+       ON CONFLICT (match_id) DO NOTHING""",
+    # Per-participant read watermarks
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user1_last_read_at TIMESTAMP",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user1_last_read_message_id TEXT",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user2_last_read_at TIMESTAMP",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user2_last_read_message_id TEXT",
+    # Thumbnail and card renditions of asset photos
+    "ALTER TABLE assets ADD COLUMN IF NOT EXISTS renditions JSONB",
+    # Orders unread count changes for the Redis cache
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS unread_version BIGINT NOT NULL DEFAULT 0",
+    # Commit-ordered read watermarks
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_seq BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user1_last_read_seq BIGINT",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user2_last_read_seq BIGINT",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT",
+]
+
+
+def upgrade_schema(engine):
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
+    # Add any newly declared indexes to existing tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
@@ -1,9 +1,16 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from fastapi import UploadFile
+from typing import BinaryIO, Optional, Union
+import httpx
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
 
+from utils.byte_budget import ByteBudget
+
 load_dotenv()
 
 supabase_api = os.getenv("SUPABASE_API")
@@ -12,33 +19,106 @@ supabase_bucket_name = os.getenv("SUPABASE_STORAGE_NAME")
 supabase: Client = create_client(supabase_api, supabase_service_key)
 
 
-async def upload_to_supabase(file: UploadFile, file_type: str,user_id:str):
-    # Read the file content as bytes
-    file_content = await file.read()
+# Supabase storage calls block, so async code runs them on this bounded pool;
+# UPLOAD_CONCURRENCY caps the uploads in flight across the whole process
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 8))
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+
 
+def _storage_path(filename: str, file_type: str, user_id: str) -> str:
     # Generate timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     # Split filename and extension
-    filename_parts = file.filename.rsplit('.', 1)
+    filename_parts = filename.rsplit('.', 1)
     base_name = filename_parts[0]
     extension = filename_parts[1] if len(filename_parts) > 1 else ''
 
-    # Create new filename with timestamp
-    new_filename = f"{base_name}_{timestamp}.{extension}" if extension else f"{base_name}_{timestamp}"
+    # Create new filename with timestamp; the random suffix keeps concurrent
+    # uploads of same-named files within one second from colliding
+    suffix = f"{timestamp}_{uuid.uuid4().hex[:8]}"
+    new_filename = f"{base_name}_{suffix}.{extension}" if extension else f"{base_name}_{suffix}"
 
     # Generate unique ID for the file path
-    file_path = f"{file_type}/{user_id}/{new_filename}"
+    return f"{file_type}/{user_id}/{new_filename}"
+
+
+# Uploads go to the storage REST API directly so files can be streamed from
+# their spool in STORAGE_CHUNK_SIZE pieces instead of read whole into memory
+STORAGE_CHUNK_SIZE = 64 * 1024
+storage_http = httpx.Client(
+    base_url=f"{supabase_api}/storage/v1",
+    headers={
+        "apikey": supabase_service_key,
+        "Authorization": f"Bearer {supabase_service_key}",
+    },
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+
+# Bytes of uploads in flight: per process, and per request (see new_request_budget)
+UPLOAD_PROCESS_BYTES = int(os.getenv("UPLOAD_PROCESS_BYTES", 64 * 1024 * 1024))
+UPLOAD_REQUEST_BYTES = int(os.getenv("UPLOAD_REQUEST_BYTES", 16 * 1024 * 1024))
+upload_budget = ByteBudget(UPLOAD_PROCESS_BYTES)
+
+
+def new_request_budget() -> ByteBudget:
+    return ByteBudget(UPLOAD_REQUEST_BYTES)
+
+
+def _file_size(file: Union[bytes, str, BinaryIO]) -> int:
+    if isinstance(file, bytes):
+        return len(file)
+    if isinstance(file, str):
+        return os.path.getsize(file)
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    return size
+
+
+def _iter_chunks(file: BinaryIO):
+    while True:
+        chunk = file.read(STORAGE_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _put_object(file_path: str, file: Union[bytes, BinaryIO], content_type: str):
+    headers = {"content-type": content_type, "x-upsert": "false"}
+    if isinstance(file, bytes):
+        content = file
+    else:
+        # Content-Length up front so the body is sent as a plain stream
+        headers["content-length"] = str(_file_size(file))
+        content = _iter_chunks(file)
+    response = storage_http.post(
+        f"/object/{supabase_bucket_name}/{file_path}", content=content, headers=headers)
+    response.raise_for_status()
+
+
+def store_file(file: Union[bytes, str, BinaryIO], filename: str, content_type: str, file_type: str, user_id: str) -> str:
+    """Upload bytes, a binary file object or the file at a local path, and
+    return its public URL. Blocking: call it from a worker thread."""
+    file_path = _storage_path(filename, file_type, user_id)
 
     # Upload the file to Supabase Storage
-    supabase.storage.from_(supabase_bucket_name).upload(
-        path=file_path,
-        file=file_content,  # Pass the bytes directly
-        file_options={"content-type": file.content_type}
-    )
+    if isinstance(file, str):
+        with open(file, "rb") as local_file:
+            _put_object(file_path, local_file, content_type)
+    else:
+        _put_object(file_path, file, content_type)
 
     # Get the public URL of the uploaded file
-    file_url = supabase.storage.from_(
+    return supabase.storage.from_(
         supabase_bucket_name).get_public_url(file_path)
 
-    return file_url
+
+async def store_file_async(file: Union[bytes, str, BinaryIO], filename: str, content_type: str,
+                           file_type: str, user_id: str, request_budget: Optional[ByteBudget] = None) -> str:
+    # Waits for room in the request's and the process's byte budgets first
+    size = _file_size(file)
+    async with (request_budget.reserve(size) if request_budget else nullcontext()):
+        async with upload_budget.reserve(size):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                upload_executor, store_file, file, filename, content_type, file_type, user_id)
@@ -13,9 +13,13 @@ import time
 from datetime import datetime
 
 from config.database import engine
+from config.schema_upgrades import upgrade_schema
 from models.base import Base
 from routes import auth, asset, match, profile, message
-from sockets import sio_server
+from sockets import sio_server, start_presence_heartbeat
+from utils.feed import refresh_active_feeds
+from utils.loop_monitor import start_loop_lag_monitor
+from utils.match_cache import start_match_invalidation_listener
 
 # Configure logging
 logging.basicConfig(
@@ -52,6 +56,7 @@ def ping_server():
 
 def run_scheduler():
     schedule.every(15).minutes.do(ping_server)
+    schedule.every(5).minutes.do(refresh_active_feeds)
     
     while True:
         schedule.run_pending()
@@ -68,10 +73,18 @@ app.include_router(match.router, prefix="/match")
 app.include_router(profile.router, prefix="/profile")
 app.include_router(message.router, prefix="/message")
 
-# Create all tables
-Base.metadata.create_all(engine)
+def setup_database():
+    # On startup rather than at import: worker processes (utils/renditions.py)
+    # import this module as __mp_main__ and must not run DDL
+    # Create all tables
+    Base.metadata.create_all(engine)
 
-starlette_app = Starlette(debug=True)
+    # create_all skips tables that already exist, so bring their columns and indexes up to date
+    upgrade_schema(engine)
+
+starlette_app = Starlette(debug=True, on_startup=[
+    setup_database, start_presence_heartbeat, start_loop_lag_monitor,
+    start_match_invalidation_listener])
 starlette_app.mount("/", app)
 
 sio_app = socketio.ASGIApp(sio_server, starlette_app, socketio_path='/sockets')
@@ -8,18 +8,25 @@ load_dotenv()
 jwt_secret = os.getenv('JWT_SECRET')
 
 
-def auth_middleware(x_auth_token=Header()):
+def user_id_from_token(token) -> str:
+    # Shared by the HTTP routes and the socket login
     try:
-        if not x_auth_token:
+        if not token:
             raise HTTPException(401, "Access denied!! No auth token found.")
 
-        isVerified = jwt.decode(x_auth_token, jwt_secret, ['HS256'])
+        isVerified = jwt.decode(token, jwt_secret, ['HS256'])
 
         if not isVerified:
             raise HTTPException(
                 401, "Access denied!! Token verification failed.")
 
-        uid = isVerified.get("id")
-        return {"uid": uid, "token": x_auth_token}
+        return isVerified.get("id")
     except jwt.PyJWTError as e:
         raise HTTPException(401, "Access denied!! Auth token not valid.")
+
+
+# async so FastAPI runs it on the event loop rather than in the threadpool;
+# it only decodes the token
+async def auth_middleware(x_auth_token=Header()):
+    uid = user_id_from_token(x_auth_token)
+    return {"uid": uid, "token": x_auth_token}
@@ -3,6 +3,8 @@ from models.user import User
 from models.asset import Asset
 from models.message import Message
 from models.match import Match
+from models.conversation import Conversation
+from models.stored_object import StoredObject
 
 # Initialize relationships
 User.assets
@@ -21,4 +23,4 @@ Message.match
 # You can add any other necessary initializations here
 
 # This line is optional, but it can be helpful to explicitly define what should be imported when someone does `from models import *`
-__all__ = ['User', 'Asset', 'Message', 'Match']
\ No newline at end of file
+__all__ = ['User', 'Asset', 'Message', 'Match', 'Conversation', 'StoredObject']
\ No newline at end of file
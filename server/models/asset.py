@@ -1,19 +1,26 @@
-from sqlalchemy import VARCHAR, TEXT, Column, DateTime, ARRAY, ForeignKey, func
+from sqlalchemy import VARCHAR, TEXT, Column, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import relationship
 from models.base import Base
 
 
 class Asset(Base):
     __tablename__ = 'assets'
+    __table_args__ = (
+        # Inverted index so passion filters use the array overlap operator
+        Index('ix_assets_passion_list', 'passion_list', postgresql_using='gin'),
+    )
 
     id = Column(TEXT, primary_key=True)
     profile_picture = Column(VARCHAR(255), nullable=True)
     image_list = Column(ARRAY(TEXT), nullable=True)
     passion_list = Column(ARRAY(TEXT), nullable=True)
+    # Resized WebP copies of each photo: {original url: {"thumb": url, "card": url}}
+    renditions = Column(JSONB, nullable=True)
     created_at = Column(DateTime, default=func.now(), nullable=True)
     updated_at = Column(DateTime, default=func.now(),
                         onupdate=func.now(), nullable=True)
-    user_id = Column(TEXT, ForeignKey("users.id"))
+    user_id = Column(TEXT, ForeignKey("users.id"), index=True)
 
     # Use string for late binding
     user = relationship('User', back_populates='assets')
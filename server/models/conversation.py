@@ -0,0 +1,49 @@
+from sqlalchemy import Column, DateTime, ForeignKey, TEXT, INTEGER, BIGINT, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from models.base import Base
+
+
+class Conversation(Base):
+    """Per-match inbox summary, maintained in the same transaction as message writes."""
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        # Inbox listing for either participant, newest activity first
+        Index('ix_conversations_user1_id_last_message_at', 'user1_id', 'last_message_at'),
+        Index('ix_conversations_user2_id_last_message_at', 'user2_id', 'last_message_at'),
+    )
+
+    match_id = Column(TEXT, ForeignKey("matches.id"), primary_key=True)
+    # Same participants, in the same order, as the match
+    user1_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
+    user2_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(TEXT, nullable=False)
+    last_message_preview = Column(TEXT, nullable=True)
+    last_message_sender_id = Column(TEXT, nullable=False)
+    last_message_at = Column(DateTime, nullable=False)
+    # Messages recorded so far. Assigned under the row lock, so unlike
+    # created_at it follows commit order; each message keeps its own as seq.
+    last_message_seq = Column(BIGINT, default=0, nullable=False)
+    # Messages each participant has not read yet
+    user1_unread_count = Column(INTEGER, default=0, nullable=False)
+    user2_unread_count = Column(INTEGER, default=0, nullable=False)
+    # Bumped by every change to either unread count, so cached counts can
+    # tell a newer value from a late one
+    unread_version = Column(BIGINT, default=0, nullable=False)
+    # Read watermarks: each participant has seen every message with a seq up
+    # to last_read_seq, and every older message without one up to and
+    # including (last_read_at, last_read_message_id)
+    user1_last_read_seq = Column(BIGINT, nullable=True)
+    user1_last_read_at = Column(DateTime, nullable=True)
+    user1_last_read_message_id = Column(TEXT, nullable=True)
+    user2_last_read_seq = Column(BIGINT, nullable=True)
+    user2_last_read_at = Column(DateTime, nullable=True)
+    user2_last_read_message_id = Column(TEXT, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    match = relationship("Match")
+
+    def __repr__(self):
+        return (f"<Conversation(match_id={self.match_id}, user1_id={self.user1_id}, "
+                f"user2_id={self.user2_id}, last_message_id={self.last_message_id}, "
+                f"last_message_at={self.last_message_at})>")
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, DateTime, ForeignKey, Enum, TEXT
+from sqlalchemy import Column, DateTime, ForeignKey, Enum, Index, TEXT, type_coerce
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from models.base import Base
@@ -12,12 +12,41 @@ class MatchStatus(enum.Enum):
     REJECTED = "REJECTED"
 
 
+def make_pair_key(user_a_id: str, user_b_id: str) -> str:
+    # Same key whichever user started the match; byte order matches COLLATE "C"
+    return f"{min(user_a_id, user_b_id)}:{max(user_a_id, user_b_id)}"
+
+
+def pair_key_expression(user_a_id, user_b_id):
+    # SQL counterpart of make_pair_key, for correlating against another table
+    user_a = type_coerce(user_a_id, TEXT).collate("C")
+    user_b = type_coerce(user_b_id, TEXT).collate("C")
+    # Compare under the column's collation, or ux_matches_pair_key is not used
+    return func.concat(
+        func.least(user_a, user_b), ':', func.greatest(user_a, user_b)
+    ).collate("default")
+
+
+def _pair_key_default(context):
+    params = context.get_current_parameters()
+    return make_pair_key(params["user1_id"], params["user2_id"])
+
+
 class Match(Base):
     __tablename__ = 'matches'
+    __table_args__ = (
+        # Pair lookups and INSERT ... ON CONFLICT (pair_key) for match creation
+        Index('ux_matches_pair_key', 'pair_key', unique=True),
+        # Per-user listings of matches and requests
+        Index('ix_matches_user1_id_user2_id', 'user1_id', 'user2_id'),
+        Index('ix_matches_user2_id_user1_id', 'user2_id', 'user1_id'),
+    )
 
     id = Column(TEXT, primary_key=True, default=lambda: str(uuid.uuid4()))
     user1_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
     user2_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
+    # One row per pair of users, whichever direction; see make_pair_key
+    pair_key = Column(TEXT, nullable=False, default=_pair_key_default)
     status = Column(Enum(MatchStatus),
                     default=MatchStatus.UNMATCHED, nullable=False)
     created_at = Column(DateTime, default=func.now(), nullable=False)
@@ -1,20 +1,29 @@
-from sqlalchemy import Column, DateTime, ForeignKey, TEXT, String,Boolean
+from sqlalchemy import Column, DateTime, ForeignKey, TEXT, String,Boolean, BIGINT, Index
 from sqlalchemy.sql import func
 from models.base import Base
 from sqlalchemy.orm import relationship
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Keyset pagination of a conversation's history
+        Index('ix_messages_match_id_created_at_id', 'match_id', 'created_at', 'id'),
+    )
 
     id = Column(TEXT, primary_key=True)
     match_id = Column(TEXT, ForeignKey("matches.id"), nullable=False)
-    sender_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
-    recipient_id = Column(TEXT, ForeignKey("users.id"), nullable=False)
+    sender_id = Column(TEXT, ForeignKey("users.id"), nullable=False, index=True)
+    recipient_id = Column(TEXT, ForeignKey("users.id"), nullable=False, index=True)
     content = Column(TEXT, nullable=True)
     content_type = Column(String, nullable=False, default="text")
     file_url = Column(TEXT, nullable=True)
     created_at = Column(DateTime, default=func.now(), nullable=False)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    # Position in the conversation in commit order (Conversation.last_message_seq);
+    # NULL for messages sent before it existed
+    seq = Column(BIGINT, nullable=True)
+    # Legacy per-row flag, no longer written: read state is the recipient's
+    # watermark on the conversation (see utils.conversations.is_seen)
     seen = Column(Boolean, default=False, nullable=False)
 
     # Relationship to Match table
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, DateTime, TEXT, INTEGER, BIGINT, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from models.base import Base
+
+
+class StoredObject(Base):
+    """Content-addressed index of uploaded photos, so identical uploads reuse
+    one stored object (and its renditions) instead of storing a new copy."""
+    __tablename__ = 'stored_objects'
+    __table_args__ = (
+        # Releasing a reference starts from the URL kept on the asset
+        Index('ix_stored_objects_url', 'url'),
+    )
+
+    # Hex SHA-256 of the file contents
+    content_hash = Column(TEXT, primary_key=True)
+    url = Column(TEXT, nullable=False)
+    content_type = Column(TEXT, nullable=True)
+    size = Column(BIGINT, nullable=False)
+    # Same shape as one entry of Asset.renditions: {"thumb": url, "card": url}
+    renditions = Column(JSONB, nullable=True)
+    # Asset photo slots currently pointing at this object
+    ref_count = Column(INTEGER, default=1, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import VARCHAR, TEXT, Enum, Column, DateTime, INTEGER, func, extract
+from sqlalchemy import VARCHAR, TEXT, Enum, Column, DateTime, INTEGER, Index, func, extract
 from sqlalchemy.orm import relationship
 from models.base import Base
 from datetime import datetime
@@ -11,6 +11,13 @@ class Gender(enum.Enum):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Keyset pagination order for match suggestions
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+        # Age/gender discovery filters become index range scans on dob
+        Index('ix_users_gender_dob', 'gender', 'dob'),
+        Index('ix_users_dob', 'dob'),
+    )
 
     id = Column(TEXT, primary_key=True)
     name = Column(VARCHAR(100), nullable=False)
@@ -38,8 +45,8 @@ class User(Base):
 
     @age.expression
     def age(cls):
-        # Calculate age approximately by year only in SQL
-        return extract('year', func.now()) - extract('year', cls.dob)
+        # Whole years elapsed since dob, matching the Python property
+        return extract('year', func.age(cls.dob))
 
     def __repr__(self):
         return (f"<User(id={self.id}, name={self.name}, phone={self.phone}, "
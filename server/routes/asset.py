@@ -6,10 +6,12 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
 from models.user import User
-from config.database import get_db
-from config.supabase_client import upload_to_supabase
+from config.database import get_db, run_in_db_executor
+from config.supabase_client import new_request_budget
 from middleware.auth_middleware import auth_middleware
 from models.asset import Asset
+from utils.renditions import gather_uploads, release_uploads, upload_with_renditions
+from utils.stored_objects import release_stored_objects
 
 router = APIRouter(tags=["Asset"])
 
@@ -22,6 +24,8 @@ async def upload_assets(
         passion_list: Optional[List[str]] = Form(None),
         db: Session = Depends(get_db)):
 
+    # Uploaded photos not yet saved on the asset; released if the request fails
+    unsaved_urls = []
     try:
         # Check if user exists in the database
         user = db.query(User).filter(User.id == user_id).first()
@@ -32,16 +36,21 @@ async def upload_assets(
         uploaded_image_list = []
         uploaded_passion_list = passion_list if passion_list else []
 
-    # Upload profile picture if provided
-        profile_pic = None
+    # Upload the profile picture and images concurrently, each with its
+    # thumbnail/card renditions, so the request takes about one upload's latency
+        budget = new_request_budget()
+        uploads = []
         if profile_picture:
-            profile_pic = await upload_to_supabase(profile_picture, "profile_picture", user_id)
+            uploads.append(upload_with_renditions(profile_picture, "profile_picture", user_id, budget))
+        for image in image_list or []:
+            uploads.append(upload_with_renditions(image, "image_list", user_id, budget))
+        results = await gather_uploads(*uploads)
 
-    # Upload images if provided
-        if image_list:
-            for image in image_list:
-                url = await upload_to_supabase(image, "image_list", user_id)
-                uploaded_image_list.append(url)
+        renditions = {url: image_renditions for url, image_renditions in results if image_renditions}
+        urls = [url for url, _ in results]
+        unsaved_urls = list(urls)
+        profile_pic = urls.pop(0) if profile_picture else None
+        uploaded_image_list.extend(urls)
 
     # Create and save the asset
         uploaded_passion_list[0] = ast.literal_eval(uploaded_passion_list[0])
@@ -50,10 +59,12 @@ async def upload_assets(
             profile_picture=profile_pic,
             passion_list=uploaded_passion_list[0],
             image_list=uploaded_image_list,
+            renditions=renditions,
             user_id=user.id,
         )
         db.add(asset)
         db.commit()
+        unsaved_urls = []
         db.refresh(asset)
 
         return {"message": "Upload completed successfully", "asset_id": asset_id}
@@ -69,6 +80,8 @@ async def upload_assets(
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred."
         )
+    finally:
+        await release_uploads(unsaved_urls)
 
 
 @router.get("/")
@@ -86,6 +99,7 @@ def get_assets(db: Session = Depends(get_db), user_dict=Depends(auth_middleware)
             "profile_picture": assets.profile_picture,
             "passion_list": assets.passion_list,
             "image_list": assets.image_list,
+            "renditions": assets.renditions or {},
             "user_id": assets.user_id,
             "created_at": assets.created_at,
             "updated_at": assets.updated_at,
@@ -119,6 +133,7 @@ def get_assets_by_userId(user_id: str, db: Session = Depends(get_db), user_dict=
             "profile_picture": assets.profile_picture,
             "passion_list": assets.passion_list,
             "image_list": assets.image_list,
+            "renditions": assets.renditions or {},
             "user_id": assets.user_id,
             "created_at": assets.created_at,
             "updated_at": assets.updated_at,
@@ -144,6 +159,8 @@ async def update_image_list(
         user_dict=Depends(auth_middleware),
         db: Session = Depends(get_db)):
 
+    # Uploaded photos not yet saved on the asset; released if the request fails
+    unsaved_urls = []
     try:
         # Check if the user exists in the database
         user = db.query(User).filter(User.id == user_dict["uid"]).first()
@@ -171,28 +188,47 @@ async def update_image_list(
             )
             db.add(user_asset)
 
-        # Add new images to the list at specified indices
-        for idx, new_image in zip(edit_indices, image_list):
-            # Upload the new image and get its URL
-            new_image_url = await upload_to_supabase(new_image, "image_list", user.id)
+        # Upload the new images concurrently, then place them in order
+        edits = list(zip(edit_indices, image_list or []))
+        budget = new_request_budget()
+        results = await gather_uploads(*[
+            upload_with_renditions(new_image, "image_list", user.id, budget) for _, new_image in edits
+        ])
+        unsaved_urls = [url for url, _ in results]
 
+        # Add new images to the list at specified indices
+        renditions = dict(user_asset.renditions or {})
+        replaced_urls = []
+        for (idx, _), (new_image_url, image_renditions) in zip(edits, results):
             # Replace or append the image at the specified index
             if idx < len(updated_image_list):
+                replaced_urls.append(updated_image_list[idx])
                 updated_image_list[idx] = new_image_url  # Replace image
             else:
                 # Append if index exceeds current list length
                 updated_image_list.append(new_image_url)
+            if image_renditions:
+                renditions[new_image_url] = image_renditions
+
+        # Keep renditions only for photos the asset still shows
+        kept_urls = set(updated_image_list) | {user_asset.profile_picture}
+        renditions = {url: value for url, value in renditions.items() if url in kept_urls}
 
         # Update the asset's image_list with modified data
         user_asset.image_list = updated_image_list
+        user_asset.renditions = renditions
         db.commit()
+        unsaved_urls = []
         db.refresh(user_asset)
+        # Replaced photos no longer reference their stored objects
+        await run_in_db_executor(release_stored_objects, replaced_urls)
 
         return {
             "id": user_asset.id,
             "profile_picture": user_asset.profile_picture,
             "passion_list": user_asset.passion_list,
             "image_list": user_asset.image_list,
+            "renditions": user_asset.renditions or {},
             "user_id": user_asset.user_id,
             "created_at": user_asset.created_at,
             "updated_at": user_asset.updated_at
@@ -210,6 +246,8 @@ async def update_image_list(
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred."
         )
+    finally:
+        await release_uploads(unsaved_urls)
 
 
 @router.post("/update-profile-picture", status_code=200)
@@ -218,6 +256,8 @@ async def update_profile_picture(
         user_dict=Depends(auth_middleware),
         db: Session = Depends(get_db)):
 
+    # Uploaded photo not yet saved on the asset; released if the request fails
+    unsaved_urls = []
     try:
         # Check if the user exists in the database
         user = db.query(User).filter(User.id == user_dict["uid"]).first()
@@ -227,8 +267,11 @@ async def update_profile_picture(
         # Fetch the user's asset record
         user_asset = db.query(Asset).filter(Asset.user_id == user.id).first()
 
+        profile_picture_renditions = {}
         if profile_picture:
-            profile_picture_url = await upload_to_supabase(profile_picture, "profile_picture", user.id)
+            profile_picture_url, profile_picture_renditions = await upload_with_renditions(
+                profile_picture, "profile_picture", user.id)
+            unsaved_urls = [profile_picture_url]
         else:
             profile_picture_url = None
 
@@ -239,16 +282,20 @@ async def update_profile_picture(
                 profile_picture=profile_picture_url,
                 passion_list=[],
                 image_list=[],
+                renditions={profile_picture_url: profile_picture_renditions}
+                if profile_picture_renditions else {},
                 user_id=user.id,
             )
             db.add(asset)
             db.commit()
+            unsaved_urls = []
             db.refresh(asset)
             return {
                 "id": asset.id,
                 "profile_picture": asset.profile_picture,
                 "passion_list": asset.passion_list,
                 "image_list": asset.image_list,
+                "renditions": asset.renditions or {},
                 "user_id": asset.user_id,
                 "created_at": asset.created_at,
                 "updated_at": asset.updated_at
@@ -256,18 +303,27 @@ async def update_profile_picture(
 
         # Update the existing asset's profile picture if provided
         if profile_picture_url:
+            replaced_url = user_asset.profile_picture
+            kept_urls = set(user_asset.image_list or []) | {profile_picture_url}
+            renditions = {url: value for url, value in (user_asset.renditions or {}).items()
+                          if url in kept_urls}
+            if profile_picture_renditions:
+                renditions[profile_picture_url] = profile_picture_renditions
             db.query(Asset).filter(Asset.user_id == user.id).update(
-                {"profile_picture": profile_picture_url},
+                {"profile_picture": profile_picture_url, "renditions": renditions},
                 synchronize_session=False
             )
             db.commit()
+            unsaved_urls = []
             db.refresh(user_asset)
+            await run_in_db_executor(release_stored_objects, [replaced_url])
 
         return {
             "id": user_asset.id,
             "profile_picture": user_asset.profile_picture,
             "passion_list": user_asset.passion_list,
             "image_list": user_asset.image_list,
+            "renditions": user_asset.renditions or {},
             "user_id": user_asset.user_id,
             "created_at": user_asset.created_at,
             "updated_at": user_asset.updated_at
@@ -285,3 +341,5 @@ async def update_profile_picture(
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred."
         )
+    finally:
+        await release_uploads(unsaved_urls)
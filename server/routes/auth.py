@@ -1,12 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends
 import jwt
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
 from dotenv import load_dotenv
 import os
 from sqlalchemy.exc import SQLAlchemyError
 
-from config.database import get_db
+from config.database import get_db, get_async_db
 from schema.user_signup import UserSignup
 from schema.user_login import UserLogin
 from schema.phone_request import PhoneRequest
@@ -159,9 +161,11 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
 
 
 @router.get("/", status_code=200)
-def user_data(db: Session = Depends(get_db), user_dict=Depends(auth_middleware)):
+async def user_data(db: AsyncSession = Depends(get_async_db), user_dict=Depends(auth_middleware)):
     try:
-        user = db.query(User).filter(User.id == user_dict["uid"]).first()
+        user = (await db.execute(
+            select(User).where(User.id == user_dict["uid"])
+        )).scalar()
         if not user:
             raise HTTPException(404, "User not found!")
 
@@ -179,7 +183,7 @@ def user_data(db: Session = Depends(get_db), user_dict=Depends(auth_middleware))
             }
         }
     except SQLAlchemyError as e:
-        db.rollback()  # Rollback in case of any database error
+        await db.rollback()  # Rollback in case of any database error
         raise HTTPException(
             status_code=500, detail="Database error occurred while processing match request."
         )
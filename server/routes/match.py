@@ -1,20 +1,51 @@
 import uuid
-from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy import or_, and_
+import redis
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, and_, tuple_, func, case, cast, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
-from models.match import Match, MatchStatus
+from models.match import Match, MatchStatus, make_pair_key
 from models.user import User
-from models.asset import Asset
-from config.database import get_db
+from config.database import get_db, get_async_db
 from middleware.auth_middleware import auth_middleware
 from schema.user_match import UserMatch
+from schema.swipe_batch import SwipeBatch
+from utils.pagination import encode_cursor, decode_cursor
+from utils.discovery import candidate_filters, candidate_pool_query, user_passions_query
+from utils.ranking import rank_candidates
+from utils.seen_filter import add_seen
+from utils.match_cache import invalidate_matches
+from utils.feed import (
+    FEED_REFILL_THRESHOLD, build_feed_with_session, feed_params, pop_feed, refill_feed)
 
 router = APIRouter()
 router = APIRouter(tags=["Match"])
 
+# Columns returned by the match upserts
+_MATCH_COLUMNS = (Match.id, Match.user1_id, Match.user2_id,
+                  Match.status, Match.created_at, Match.updated_at)
+
+
+def _status_literal(status: MatchStatus):
+    # Typed so Postgres resolves CASE branches to the enum rather than text
+    return cast(literal(status, Match.status.type), Match.status.type)
+
+
+def _match_dict(match):
+    return {
+        "id": match.id,
+        "user1_id": match.user1_id,
+        "user2_id": match.user2_id,
+        "status": match.status,
+        "created_at": match.created_at,
+        "updated_at": match.updated_at,
+    }
+
 
 @router.post("/create-match")
 def create_match(create_match: UserMatch, db: Session = Depends(get_db), auth_dict=Depends(auth_middleware)):
@@ -25,72 +56,61 @@ def create_match(create_match: UserMatch, db: Session = Depends(get_db), auth_di
                 status_code=400, detail="You cannot send a match request to yourself."
             )
 
-        # Check if a match already exists between the two users
-        existing_match = db.query(Match).filter(
-            or_(
-                and_(Match.user1_id ==
-                     auth_dict["uid"], Match.user2_id == create_match.user2_id),
-                and_(Match.user2_id ==
-                     auth_dict["uid"], Match.user1_id == create_match.user2_id)
-            )
+        current_user_id = auth_dict["uid"]
+        pair_key = make_pair_key(current_user_id, create_match.user2_id)
+
+        # Insert a new UNMATCHED request, or accept the other user's pending
+        # request, in one race-free statement keyed on the pair
+        insert_stmt = insert(Match).values(
+            id=str(uuid.uuid4()),
+            user1_id=current_user_id,
+            user2_id=create_match.user2_id,
+            pair_key=pair_key,
+            status=MatchStatus.UNMATCHED
+        )
+        match = db.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=[Match.pair_key],
+                set_={"status": MatchStatus.ACTIVE, "updated_at": func.now()},
+                where=and_(Match.status == MatchStatus.UNMATCHED,
+                           Match.user1_id != current_user_id)
+            ).returning(*_MATCH_COLUMNS)
         ).first()
+        db.commit()
 
-        if existing_match:
-            # Handle different match statuses
-            if existing_match.status == MatchStatus.UNMATCHED:
-                if existing_match.user1_id == auth_dict["uid"]:
-                    raise HTTPException(
-                        status_code=409, detail="Match request has already been sent. Awaiting response from the other user."
-                    )
-                else:
-                    # The other user is responding, so change the status to ACTIVE
-                    existing_match.status = MatchStatus.ACTIVE
-                    db.commit()
-                    return {
-                        "message": "You are now matched!",
-                        "match": {
-                            "id": existing_match.id,
-                            "user1_id": existing_match.user1_id,
-                            "user2_id": existing_match.user2_id,
-                            "status": existing_match.status,
-                            "created_at": existing_match.created_at,
-                            "updated_at": existing_match.updated_at,
-                        }
-                    }
-
-            elif existing_match.status == MatchStatus.ACTIVE:
+        if match is None:
+            # Conflict that was not an acceptance: report the existing status
+            existing_match = db.query(Match).filter(
+                Match.pair_key == pair_key).first()
+
+            if existing_match.status == MatchStatus.ACTIVE:
                 # If the existing match is ACTIVE, inform the user
                 raise HTTPException(
                     status_code=409, detail="You are already matched with this user."
                 )
-
             elif existing_match.status == MatchStatus.REJECTED:
                 # If the existing match is REJECTED, inform the user
                 raise HTTPException(
                     status_code=409, detail="The other user rejected your request."
                 )
+            raise HTTPException(
+                status_code=409, detail="Match request has already been sent. Awaiting response from the other user."
+            )
 
-        # If no existing match, create a new one with status UNMATCHED
-        new_match = Match(
-            id=str(uuid.uuid4()),
-            user1_id=auth_dict["uid"],
-            user2_id=create_match.user2_id,
-            status=MatchStatus.UNMATCHED
-        )
-        db.add(new_match)
-        db.commit()
-        db.refresh(new_match)
+        add_seen(current_user_id, [create_match.user2_id])
+        if match.status == MatchStatus.ACTIVE:
+            # An accepted request: the pair can chat now
+            invalidate_matches([pair_key])
+
+        if match.status == MatchStatus.ACTIVE:
+            return {
+                "message": "You are now matched!",
+                "match": _match_dict(match)
+            }
 
         return {
             "message": "New match request sent with status UNMATCHED",
-            "match": {
-                "id": new_match.id,
-                "user1_id": new_match.user1_id,
-                "user2_id": new_match.user2_id,
-                "status": new_match.status,
-                "created_at": new_match.created_at,
-                "updated_at": new_match.updated_at,
-            }
+            "match": _match_dict(match)
         }
 
     except SQLAlchemyError as e:
@@ -110,57 +130,45 @@ def create_match(create_match: UserMatch, db: Session = Depends(get_db), auth_di
 @router.post("/reject-match")
 def reject_match(create_match: UserMatch, db: Session = Depends(get_db), auth_dict=Depends(auth_middleware)):
     try:
-        # Check if a match already exists between the two users
-        existing_match = db.query(Match).filter(
-            or_(
-                and_(Match.user1_id ==
-                     auth_dict["uid"], Match.user2_id == create_match.user2_id),
-                and_(Match.user2_id ==
-                     auth_dict["uid"], Match.user1_id == create_match.user2_id)
-            )
-        ).first()
-
-        if existing_match:
-            # If the match is already rejected, inform the user
-            if existing_match.status == MatchStatus.REJECTED:
-                return {"message": "You have already rejected this match request."}
+        current_user_id = auth_dict["uid"]
+        pair_key = make_pair_key(current_user_id, create_match.user2_id)
 
-            # If the match is active, or unmatched, set it to rejected
-            existing_match.status = MatchStatus.REJECTED
-            db.commit()
-            return {
-                "message": "Match request rejected successfully.",
-                "match": {
-                    "id": existing_match.id,
-                    "user1_id": existing_match.user1_id,
-                    "user2_id": existing_match.user2_id,
-                    "status": existing_match.status,
-                    "created_at": existing_match.created_at,
-                    "updated_at": existing_match.updated_at,
-                }
-            }
+        # Locked so the status it had before this rejection is exact
+        was_active = db.query(Match.status).filter(
+            Match.pair_key == pair_key).with_for_update().scalar() == MatchStatus.ACTIVE
 
-        # If no match exists, create a new one with rejected status
-        new_match = Match(
+        # Insert a REJECTED match, or flip an existing one to REJECTED, in one
+        # statement keyed on the pair. xmax = 0 only for freshly inserted rows.
+        insert_stmt = insert(Match).values(
             id=str(uuid.uuid4()),
-            user1_id=auth_dict["uid"],
+            user1_id=current_user_id,
             user2_id=create_match.user2_id,
+            pair_key=pair_key,
             status=MatchStatus.REJECTED
         )
-        db.add(new_match)
+        match = db.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=[Match.pair_key],
+                set_={"status": MatchStatus.REJECTED, "updated_at": func.now()},
+                where=Match.status != MatchStatus.REJECTED
+            ).returning(*_MATCH_COLUMNS, literal_column("(xmax = 0)").label("inserted"))
+        ).first()
         db.commit()
-        db.refresh(new_match)
+
+        # If the match is already rejected, inform the user
+        if match is None:
+            return {"message": "You have already rejected this match request."}
+
+        # A rejection hides the pair from both users' suggestions
+        add_seen(current_user_id, [create_match.user2_id])
+        add_seen(create_match.user2_id, [current_user_id])
+        if was_active:
+            # Open sockets must stop treating the pair as chattable
+            invalidate_matches([pair_key])
 
         return {
-            "message": "Match request rejected.",
-            "match": {
-                "id": new_match.id,
-                "user1_id": new_match.user1_id,
-                "user2_id": new_match.user2_id,
-                "status": new_match.status,
-                "created_at": new_match.created_at,
-                "updated_at": new_match.updated_at,
-            }
+            "message": "Match request rejected." if match.inserted else "Match request rejected successfully.",
+            "match": _match_dict(match)
         }
 
     except SQLAlchemyError as e:
@@ -175,6 +183,146 @@ def reject_match(create_match: UserMatch, db: Session = Depends(get_db), auth_di
         )
 
 
+@router.post("/swipe-batch")
+def swipe_batch(swipe_batch: SwipeBatch, db: Session = Depends(get_db), auth_dict=Depends(auth_middleware)):
+    try:
+        current_user_id = auth_dict["uid"]
+
+        # Last decision wins when the same card appears twice in a batch
+        swipes = {}
+        for swipe in swipe_batch.swipes:
+            swipes.pop(swipe.user2_id, None)
+            swipes[swipe.user2_id] = swipe.action
+
+        pair_keys = {
+            user2_id: make_pair_key(current_user_id, user2_id)
+            for user2_id in swipes if user2_id != current_user_id
+        }
+
+        # One lookup for every pair in the batch, locked (in a fixed order) so
+        # the statuses before the upsert are exact
+        existing_matches = {
+            match.pair_key: match
+            for match in db.query(Match).filter(Match.pair_key.in_(pair_keys.values()))
+            .order_by(Match.pair_key).with_for_update().all()
+        } if pair_keys else {}
+        # Read now: commit expires the instances
+        were_active = {
+            pair_key for pair_key, match in existing_matches.items()
+            if match.status == MatchStatus.ACTIVE
+        }
+
+        results = {}
+        rows = []
+        for user2_id, action in swipes.items():
+            if user2_id == current_user_id:
+                results[user2_id] = "invalid"
+                continue
+
+            existing_match = existing_matches.get(pair_keys[user2_id])
+            if existing_match is None:
+                pass
+            elif action == "reject" and existing_match.status == MatchStatus.REJECTED:
+                results[user2_id] = "already_rejected"
+                continue
+            elif action == "like" and existing_match.status == MatchStatus.ACTIVE:
+                results[user2_id] = "already_matched"
+                continue
+            elif action == "like" and existing_match.status == MatchStatus.REJECTED:
+                # Same case as the 409 from create-match, not a new rejection
+                results[user2_id] = "already_rejected"
+                continue
+            elif action == "like" and existing_match.user1_id == current_user_id:
+                results[user2_id] = "already_requested"
+                continue
+
+            rows.append({
+                "id": str(uuid.uuid4()),
+                "user1_id": current_user_id,
+                "user2_id": user2_id,
+                "pair_key": pair_keys[user2_id],
+                "status": MatchStatus.REJECTED if action == "reject" else MatchStatus.UNMATCHED,
+            })
+
+        # One multi-row upsert applying each swipe to the row as it is now: a
+        # like accepts the other user's pending request, a reject overrides
+        # anything but an existing rejection
+        matches = {}
+        if rows:
+            insert_stmt = insert(Match).values(rows)
+            accepts = and_(insert_stmt.excluded.status == MatchStatus.UNMATCHED,
+                           Match.status == MatchStatus.UNMATCHED,
+                           Match.user1_id != insert_stmt.excluded.user1_id)
+            rejects = and_(insert_stmt.excluded.status == MatchStatus.REJECTED,
+                           Match.status != MatchStatus.REJECTED)
+            matches = {
+                match.pair_key: match
+                for match in db.execute(
+                    insert_stmt.on_conflict_do_update(
+                        index_elements=[Match.pair_key],
+                        set_={
+                            "status": case((rejects, _status_literal(MatchStatus.REJECTED)),
+                                           else_=_status_literal(MatchStatus.ACTIVE)),
+                            "updated_at": func.now()
+                        },
+                        where=or_(accepts, rejects)
+                    ).returning(*_MATCH_COLUMNS, Match.pair_key)
+                )
+            }
+        db.commit()
+        # Only pairs entering or leaving ACTIVE matter to chat caches
+        invalidate_matches(
+            pair_key for pair_key, match in matches.items()
+            if (match.status == MatchStatus.ACTIVE) != (pair_key in were_active)
+        )
+
+        outcomes = []
+        new_matches = []
+        for user2_id, action in swipes.items():
+            match = matches.get(pair_keys.get(user2_id))
+            outcome = results.get(user2_id)
+            if outcome is None:
+                if match is None:
+                    # Changed concurrently so the swipe had nothing left to do
+                    outcome = "already_rejected" if action == "reject" else "already_requested"
+                elif match.status == MatchStatus.ACTIVE:
+                    outcome = "matched"
+                    new_matches.append(_match_dict(match))
+                elif match.status == MatchStatus.REJECTED:
+                    outcome = "rejected"
+                else:
+                    outcome = "requested"
+            outcomes.append({
+                "user2_id": user2_id,
+                "action": action,
+                "outcome": outcome,
+                "match": _match_dict(match) if match is not None else None,
+            })
+
+        add_seen(current_user_id, [user2_id for user2_id in pair_keys])
+        for user2_id in pair_keys:
+            if swipes[user2_id] == "reject":
+                # A rejection hides the pair from both users' suggestions
+                add_seen(user2_id, [current_user_id])
+
+        return {
+            "message": f"Processed {len(outcomes)} swipes",
+            "results": outcomes,
+            "matches": new_matches,
+        }
+
+    except SQLAlchemyError as e:
+        db.rollback()  # Rollback in case of any database error
+        raise HTTPException(
+            status_code=500, detail="Database error occurred while processing swipes."
+        )
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        raise HTTPException(
+            status_code=500, detail="An unexpected error occurred while processing swipes."
+        )
+
+
 @router.get("/match-profile")
 def match_profiles(
     match_status: str,
@@ -241,86 +389,84 @@ def match_profiles(
 
 
 @router.get("/suggest-profile-for-match")
-def suggest_match_profile(
-    db: Session = Depends(get_db),
+async def suggest_match_profile(
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
     auth_dict=Depends(auth_middleware),
     passion_list: Optional[str] = Query(None),
-    page: int = Query(1, gt=0),
+    cursor: Optional[str] = Query(None),
+    page: Optional[int] = Query(None, gt=0),
     page_size: int = Query(10, gt=0),
     low_age: int = Query(18),
     up_age: int = Query(100),
-    gender: str = Query("BOTH", regex="^(MALE|FEMALE|BOTH)$")
+    gender: str = Query("BOTH", regex="^(MALE|FEMALE|BOTH)$"),
+    order: str = Query("recent", regex="^(recent|relevance)$")
 ):
     try:
         # Get user ID from auth_dict
         current_user_id = auth_dict["uid"]
 
-        # Get IDs of users that have active or rejected matches with the current user
-        active_rejected_user_ids = db.query(Match.user1_id).filter(
-            Match.user2_id == current_user_id,
-            or_(Match.status == MatchStatus.ACTIVE,
-                Match.status == MatchStatus.REJECTED)
-        ).all() + db.query(Match.user2_id).filter(
-            Match.user1_id == current_user_id,
-            or_(Match.status == MatchStatus.ACTIVE,
-                Match.status == MatchStatus.REJECTED)
-        ).all()
-
-        # Flatten the list and use a set for uniqueness
-        active_rejected_user_ids = set(user_id for (
-            user_id,) in active_rejected_user_ids)
-
-        # Get IDs of users that the current user has sent unmatched requests to
-        unmatched_sent_user_ids = db.query(Match.user2_id).filter(
-            Match.user1_id == current_user_id,
-            # Ensure we only get unmatched requests sent by current user
-            Match.status == MatchStatus.UNMATCHED
-        ).all()
-
-        # Get IDs of users that have sent unmatched requests to the current user
-        unmatched_received_user_ids = db.query(Match.user1_id).filter(
-            Match.user2_id == current_user_id,
-            # Ensure we only get unmatched requests received by current user
-            Match.status == MatchStatus.UNMATCHED
-        ).all()
-
-        # Flatten the list of unmatched user IDs and use a set for uniqueness
-        unmatched_sent_user_ids = set(user_id for (
-            user_id,) in unmatched_sent_user_ids)
-        unmatched_received_user_ids = set(user_id for (
-            user_id,) in unmatched_received_user_ids)
-
-        # Combine the user IDs of unmatched sent requests with those having active/rejected matches
-        filtered_user_ids = active_rejected_user_ids.union(
-            unmatched_sent_user_ids)
-
         # Parse passion_list from a comma-separated string to a list
         passions = passion_list.split(",") if passion_list else []
 
-        # Query to find users excluding the authenticated user and users with active/rejected matches
-        query = db.query(User).filter(
-            User.id != current_user_id,
-            # Exclude users that have active/rejected matches or unmatched sent requests
-            User.id.notin_(filtered_user_ids)
-        ).options(joinedload(User.assets))
-
-        # Apply age filter
-        query = query.filter(
-            User.age >= low_age,
-            User.age <= up_age
-        )
-        # Apply gender filter if gender is not "BOTH"
-        if gender != "BOTH":
-            query = query.filter(User.gender == gender)
-
-        # Filter profiles based on passions if any are provided
-        if passions:
-            query = query.join(User.assets).filter(
-                or_(*[Asset.passion_list.any(passion) for passion in passions])
+        filters = candidate_filters(
+            current_user_id, low_age, up_age, gender, passions)
+
+        next_cursor = None
+        if order == "relevance":
+            # Serve the next page from the precomputed feed, building it on the
+            # request path only when there is none for these filters yet.
+            # The feed helpers use sync Redis, so they run in the threadpool.
+            params = feed_params(low_age, up_age, gender, passions)
+            try:
+                ranked_ids, remaining = await run_in_threadpool(
+                    pop_feed, current_user_id, params, page_size)
+                if not ranked_ids:
+                    await run_in_threadpool(
+                        build_feed_with_session, current_user_id, params)
+                    ranked_ids, remaining = await run_in_threadpool(
+                        pop_feed, current_user_id, params, page_size)
+                if remaining < FEED_REFILL_THRESHOLD:
+                    background_tasks.add_task(
+                        refill_feed, current_user_id, params)
+            except redis.RedisError as e:
+                # Feed store unavailable: rank on the request path instead
+                print(f"Discovery feed unavailable: {e}")
+                rank_passions = passions or (await db.execute(
+                    user_passions_query(current_user_id))).scalar() or []
+                candidates = (await db.execute(candidate_pool_query(filters))).all()
+                ranked = await run_in_threadpool(
+                    rank_candidates, candidates, rank_passions, low_age, up_age, page_size)
+                ranked_ids = [user_id for user_id, _ in ranked]
+
+            # Re-apply the filters so users swiped since the feed was built drop out
+            result = await db.execute(
+                select(User).where(User.id.in_(ranked_ids or []), *filters)
+                .options(joinedload(User.assets))
             )
+            users_by_id = {user.id: user for user in result.unique().scalars()}
+            profiles = [users_by_id[user_id]
+                        for user_id in ranked_ids or [] if user_id in users_by_id]
+        else:
+            # Stable order so a page boundary survives concurrent signups
+            query = select(User).where(*filters).options(
+                joinedload(User.assets)).order_by(User.created_at, User.id)
+
+            if cursor:
+                # Keyset pagination: seek past the last profile of the previous page
+                last_created_at, last_id = decode_cursor(cursor)
+                query = query.where(
+                    tuple_(User.created_at, User.id) > (last_created_at, last_id)
+                )
+            elif page and page > 1:
+                # Legacy offset pagination for clients that still send page numbers
+                query = query.offset((page - 1) * page_size)
 
-        # Paginate results if page and page_size are provided
-        profiles = query.offset((page - 1) * page_size).limit(page_size).all()
+            result = await db.execute(query.limit(page_size))
+            profiles = result.unique().scalars().all()
+            if profiles:
+                next_cursor = encode_cursor(
+                    profiles[-1].created_at, profiles[-1].id)
 
         # Check if profiles are empty and raise an exception if so
         if not profiles:
@@ -345,10 +491,11 @@ def suggest_match_profile(
         return {
             "message": f"Profiles found successfully for match for user id {current_user_id}",
             "users": profile_data,
+            "next_cursor": next_cursor,
         }
 
     except SQLAlchemyError:
-        db.rollback()  # Rollback in case of any database error
+        await db.rollback()  # Rollback in case of any database error
         raise HTTPException(
             status_code=500, detail="Database error occurred while processing match request."
         )
@@ -1,38 +1,82 @@
 from fastapi import HTTPException, Depends
 from sqlalchemy.orm import aliased
-from sqlalchemy import or_, func
+from sqlalchemy import or_, case
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy import and_, or_
+from sqlalchemy import or_, tuple_, select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config.database import get_db
+from config.database import get_db, get_async_db
 from models.asset import Asset
+from models.conversation import Conversation
+from models.match import Match, make_pair_key
 from models.message import Message
 from models.user import User
 from middleware.auth_middleware import auth_middleware
 from schema.message_users import MessageUsers
 from schema.unseen_message_count import UnseenMessageCount
+from utils.pagination import encode_cursor, decode_cursor
+from utils.conversations import mark_read, is_seen
+from utils.unread_counters import unread_counts, set_unread
 
 
 router = APIRouter(tags=["Message"])
 
 
 @router.post("/get-message-between-two-users", status_code=200)
-def message_between_two_users(messageUser: MessageUsers, db: Session = Depends(get_db), user_dict=Depends(auth_middleware)):
+async def message_between_two_users(messageUser: MessageUsers, db: AsyncSession = Depends(get_async_db), user_dict=Depends(auth_middleware)):
     try:
         current_user_id = user_dict["uid"]
         message_user_id = messageUser.message_user_id
-        messages = db.query(Message).filter(
-            or_(
-                and_(
-                    Message.sender_id == current_user_id,
-                    Message.recipient_id == message_user_id,),
-                and_(
-                    Message.sender_id == message_user_id,
-                    Message.recipient_id == current_user_id,)
-            )
-        ).all()
-        return messages
+
+        match_id = (await db.execute(
+            select(Match.id).where(
+                Match.pair_key == make_pair_key(current_user_id, message_user_id))
+        )).scalar()
+        if match_id is None:
+            return []
+
+        conversation = (await db.execute(
+            select(Conversation).where(Conversation.match_id == match_id)
+        )).scalar()
+
+        query = select(Message).where(Message.match_id == match_id)
+        if messageUser.after:
+            # Messages newer than the cursor, oldest first
+            created_at, message_id = decode_cursor(messageUser.after)
+            query = query.where(
+                tuple_(Message.created_at, Message.id) > (created_at, message_id)
+            ).order_by(Message.created_at, Message.id).limit(messageUser.limit)
+            messages = (await db.execute(query)).scalars().all()
+        else:
+            # The newest messages, or the ones just before the cursor
+            if messageUser.before:
+                created_at, message_id = decode_cursor(messageUser.before)
+                query = query.where(
+                    tuple_(Message.created_at, Message.id) < (created_at, message_id)
+                )
+            query = query.order_by(
+                Message.created_at.desc(), Message.id.desc()
+            ).limit(messageUser.limit)
+            messages = list(reversed((await db.execute(query)).scalars().all()))
+
+        return [
+            {
+                "id": message.id,
+                "match_id": message.match_id,
+                "sender_id": message.sender_id,
+                "recipient_id": message.recipient_id,
+                "content": message.content,
+                "content_type": message.content_type,
+                "file_url": message.file_url,
+                "seen": is_seen(conversation, message),
+                "created_at": message.created_at,
+                "updated_at": message.updated_at,
+                # Pass as before/after to page from this message
+                "cursor": encode_cursor(message.created_at, message.id),
+            }
+            for message in messages
+        ]
     except HTTPException as e:
         raise e  # Rethrow HTTP exceptions to avoid them being caught as 500 errors
     except Exception as e:
@@ -43,108 +87,87 @@ def message_between_two_users(messageUser: MessageUsers, db: Session = Depends(g
 
 
 @router.get("/messages-user")
-def messages_user(db: Session = Depends(get_db), user_dict=Depends(auth_middleware)):
+async def messages_user(db: AsyncSession = Depends(get_async_db), user_dict=Depends(auth_middleware)):
     try:
         current_user_id = user_dict["uid"]
 
-        # Step 1: Fetch messages with basic details (without joining user or assets yet)
-        last_message_subquery = (
-            db.query(
-                Message.match_id,
-                func.max(Message.created_at).label("last_message_time")
-            )
-            .filter(
-                or_(
-                    Message.sender_id == current_user_id,
-                    Message.recipient_id == current_user_id
-                )
-            )
-            .group_by(Message.match_id)
-            .subquery()
+        # Step 1: The user's conversation summaries, newest activity first,
+        # joined to the other participant
+        other_user_id = case(
+            (Conversation.user1_id == current_user_id, Conversation.user2_id),
+            else_=Conversation.user1_id
         )
 
-        messages = (
-            db.query(
-                Message.id.label("message_id"),
-                Message.match_id,
-                Message.content.label("last_message_content"),
-                Message.created_at.label("last_message_time"),
-                Message.sender_id,
-                Message.recipient_id
+        conversations = (await db.execute(
+            select(
+                Conversation.last_message_id.label("message_id"),
+                Conversation.match_id,
+                Conversation.last_message_preview.label("last_message_content"),
+                Conversation.last_message_at.label("last_message_time"),
+                Conversation.last_message_sender_id.label("sender_id"),
+                User.id,
+                User.name,
+                User.phone,
+                User.dob,
+                User.age,
+                User.gender,
+                User.created_at,
+                User.updated_at
             )
-            .join(last_message_subquery,
-                  (Message.match_id == last_message_subquery.c.match_id) &
-                  (Message.created_at == last_message_subquery.c.last_message_time))
-            .filter(
+            .join(User, User.id == other_user_id)
+            .where(
                 or_(
-                    Message.sender_id == current_user_id,
-                    Message.recipient_id == current_user_id
-                )
-            )
-            .order_by(last_message_subquery.c.last_message_time.desc())
-            .all()
-        )
-
-        # Step 2: Process each message to determine the other user's details
-        response = []
-        for message in messages:
-            other_user_id = None
-            if message.sender_id == current_user_id:
-                other_user_id = message.recipient_id
-            elif message.recipient_id == current_user_id:
-                other_user_id = message.sender_id
-
-            # Step 3: Fetch the other user's details and assets
-            user_details = (
-                db.query(
-                    User.id,
-                    User.name,
-                    User.phone,
-                    User.dob,
-                    User.age,
-                    User.gender,
-                    User.created_at,
-                    User.updated_at
+                    Conversation.user1_id == current_user_id,
+                    Conversation.user2_id == current_user_id
                 )
-                .filter(User.id == other_user_id)
-                .first()
             )
-
-            # Fetch user assets if they exist
-            user_assets = (
-                db.query(
+            .order_by(Conversation.last_message_at.desc())
+        )).all()
+
+        # Step 2: Assets of every other user in one batched IN query
+        user_ids = [conversation.id for conversation in conversations]
+        assets_by_user_id = {
+            asset.user_id: asset
+            for asset in (await db.execute(
+                select(
                     Asset.id,
                     Asset.user_id,
                     Asset.profile_picture,
                     Asset.image_list,
                     Asset.passion_list,
+                    Asset.renditions,
                     Asset.created_at,
                     Asset.updated_at
                 )
-                .filter(Asset.user_id == other_user_id)
-                .first()
-            )
+                .where(Asset.user_id.in_(user_ids))
+                .distinct(Asset.user_id)
+                .order_by(Asset.user_id, Asset.created_at)
+            )).all()
+        } if user_ids else {}
 
+        response = []
+        for conversation in conversations:
             # Construct the response for the current message and the other user's details and assets
             message_response = {
-                "message_id": message.message_id,
-                "match_id": message.match_id,
-                "last_message_content": message.last_message_content or "You have not messaged anyone yet",
-                "last_message_time": message.last_message_time,
-                "sender_id": message.sender_id,
+                "message_id": conversation.message_id,
+                "match_id": conversation.match_id,
+                "last_message_content": conversation.last_message_content or "You have not messaged anyone yet",
+                "last_message_time": conversation.last_message_time,
+                "sender_id": conversation.sender_id,
                 "interacted_user_details": {
-                    "id": user_details.id,
-                    "name": user_details.name,
-                    "phone": user_details.phone,
-                    "dob": user_details.dob,
-                    "age": user_details.age,
-                    "gender": user_details.gender,
-                    "created_at": user_details.created_at,
-                    "updated_at": user_details.updated_at,
+                    "id": conversation.id,
+                    "name": conversation.name,
+                    "phone": conversation.phone,
+                    "dob": conversation.dob,
+                    "age": conversation.age,
+                    "gender": conversation.gender,
+                    "created_at": conversation.created_at,
+                    "updated_at": conversation.updated_at,
                 },
             }
 
             # Add the user assets field only if asset data exists
+            user_assets = assets_by_user_id.get(conversation.id)
             if user_assets:
                 message_response["interacted_user_assets"] = {
                     "id": user_assets.id,
@@ -152,6 +175,7 @@ def messages_user(db: Session = Depends(get_db), user_dict=Depends(auth_middlewa
                     "profile_picture": user_assets.profile_picture,
                     "image_list": user_assets.image_list or [],
                     "passion_list": user_assets.passion_list or [],
+                    "renditions": user_assets.renditions or {},
                     "created_at": user_assets.created_at,
                     "updated_at": user_assets.updated_at,
                 }
@@ -174,11 +198,7 @@ def unseen_messages_count(unseen_message_count: UnseenMessageCount, db: Session
     try:
         current_user_id = user_dict["uid"]
         recipient_id = unseen_message_count.recipient_id
-        unseen_count = db.query(Message).filter(
-            Message.sender_id == recipient_id,
-            Message.recipient_id == current_user_id,
-            Message.seen == False,
-        ).count()
+        unseen_count = unread_counts(db, current_user_id).get(recipient_id, 0)
 
         return {"message": unseen_count}
     except HTTPException as e:
@@ -190,6 +210,23 @@ def unseen_messages_count(unseen_message_count: UnseenMessageCount, db: Session
         )
 
 
+@router.get("/unseen-messages-counts")
+def unseen_messages_counts(db: Session = Depends(get_db), user_dict=Depends(auth_middleware)):
+    try:
+        current_user_id = user_dict["uid"]
+
+        # Unread count of every conversation, keyed by the other user's id;
+        # conversations with nothing unread are left out
+        return {"counts": unread_counts(db, current_user_id)}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        raise HTTPException(
+            status_code=500, detail="An unexpected error occurred."
+        )
+
+
 @router.post("/update-seen-messages")
 def update_seen_messages(
     unseen_message_count: UnseenMessageCount,
@@ -200,15 +237,13 @@ def update_seen_messages(
         current_user_id = user_dict["uid"]
         recipient_id = unseen_message_count.recipient_id
 
-        # Query to update messages
-        updated_rows = db.query(Message).filter(
-            Message.sender_id == recipient_id,
-            Message.recipient_id == current_user_id,
-            Message.seen == False
-        ).update({"seen": True}, synchronize_session=False)
+        # Move the read watermark instead of flagging every unread row
+        unread_version = mark_read(db, current_user_id, recipient_id)
 
         # Commit changes
         db.commit()
+        if unread_version is not None:
+            set_unread(current_user_id, recipient_id, 0, unread_version)
 
         return {"message": 0}
     except HTTPException as e:
@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
 
 class MessageUsers(BaseModel):
-    message_user_id:str
\ No newline at end of file
+    message_user_id:str
+    before: Optional[str] = None
+    after: Optional[str] = None
+    limit: int = Field(50, gt=0, le=200)
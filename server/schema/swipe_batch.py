@@ -0,0 +1,10 @@
+from typing import List, Literal
+from pydantic import BaseModel, Field
+
+class Swipe(BaseModel):
+    user2_id: str
+    action: Literal["like", "reject"]
+
+class SwipeBatch(BaseModel):
+    # Bounds the IN lookup and the multi-row upsert of one request
+    swipes: List[Swipe] = Field(..., max_length=100)
@@ -2,26 +2,65 @@ from starlette.applications import Starlette
 from fastapi import HTTPException
 import socketio
 from datetime import datetime
-from sqlalchemy import or_, and_
 import uuid
-from config.supabase_client import upload_to_supabase
+from sqlalchemy import case, or_
+from config.supabase_client import store_file_async
 import base64
+import asyncio
+import os
+from dotenv import load_dotenv
 
-from models.match import Match, MatchStatus
-from config.database import get_db_socket
+from models.match import Match, MatchStatus, make_pair_key
+from config.database import get_db_socket, run_in_db_executor
 from models.message import Message
+from utils.conversations import record_message, mark_read
+from utils.unread_counters import set_unread
+from utils.presence import (
+    HEARTBEAT_INTERVAL_SECONDS, get_presence, refresh_online, set_offline, set_online)
+from config.redis_client import redis_url
+from utils.loop_monitor import timed_handler
+from middleware.auth_middleware import user_id_from_token
+from utils.match_cache import MatchCache, current_generation, on_invalidate
+from utils.attachments import (
+    ATTACHMENT_CHUNK_SIZE, AttachmentError, discard_attachments, get_attachment,
+    pop_attachment, start_attachment)
+
+load_dotenv()
+
+# "redis" shares rooms and emits between workers and hosts over Redis pub/sub;
+# "memory" keeps them in this process, for running a single worker locally
+SOCKET_MANAGER = os.getenv('SOCKET_MANAGER', 'redis')
+
+
+def _client_manager():
+    if SOCKET_MANAGER == 'memory':
+        return None
+    return socketio.AsyncRedisManager(redis_url())
+
 
 # Socket.IO event server
 sio_server = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=_client_manager(),
     cors_allowed_origins=[],
     transports=['websocket', 'polling'],
     engineio_logger=True
 )
 
 
-# Dictionary to store user session information
-user_sessions = {}
+# Sockets logged in on this process, by user id. Presence itself lives in
+# Redis (utils/presence.py); this is only what this process keeps alive.
+local_user_sids = {}
+
+
+# Largest page of match presence sent at login or per presence_snapshot
+PRESENCE_PAGE_SIZE = 100
+
+
+def user_room(user_id: str) -> str:
+    # Every socket a user logs in from joins their room; events for that user
+    # are delivered there instead of being broadcast
+    return f"user:{user_id}"
 
 
 @sio_server.event
@@ -29,27 +68,80 @@ async def connect(sid, data):
     print(f'{sid}: trying to connect')
 
 
-@sio_server.event
-async def login(sid, data):
-    user_id = data.get('user_id')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User not authenticated")
+def _matched_user_ids(user_id: str):
+    # Users with an ACTIVE match with user_id: the only ones who see their presence
+    with get_db_socket() as db:
+        return [
+            other_user_id for (other_user_id,) in db.query(
+                case((Match.user1_id == user_id, Match.user2_id),
+                     else_=Match.user1_id)
+            ).filter(
+                or_(Match.user1_id == user_id, Match.user2_id == user_id),
+                Match.status == MatchStatus.ACTIVE
+            ).order_by(Match.created_at, Match.id).all()
+        ]
+
+
+async def _presence_page(user_ids, page: int, page_size: int):
+    page_user_ids = user_ids[(page - 1) * page_size:page * page_size]
+    presence = await get_presence(page_user_ids)
+    return {
+        'online_users': {
+            user_id: entry
+            for user_id, entry in presence.items()
+            if entry.get('status') == 'ONLINE'
+        },
+        'page': page,
+        'has_more': len(user_ids) > page * page_size,
+    }
+
+
+async def _broadcast_presence(user_id: str, matched_user_ids, status: str):
+    # Small delta to matched users only, rather than the whole session map to everyone
+    if matched_user_ids:
+        await sio_server.emit('presence', {
+            'user_id': user_id,
+            'status': status,
+            'timestamp': datetime.now().isoformat()
+        }, to=[user_room(matched_user_id) for matched_user_id in matched_user_ids])
 
-    print(f'{sid}: User ID received: {user_id}')
 
+@sio_server.event
+@timed_handler
+async def login(sid, data):
+    data = data if isinstance(data, dict) else {}
     try:
-        if user_id not in user_sessions:
-            user_sessions[user_id] = {
-                'socket_id': sid,
-                'status': 'ONLINE',
-                'timestamp': datetime.now().isoformat()
-            }
-        else:
-            user_sessions[user_id]['socket_id'] = sid
-            user_sessions[user_id]['status'] = 'ONLINE'
-            user_sessions[user_id]['timestamp'] = datetime.now().isoformat()
-
-        await sio_server.emit('join', {'online_users': user_sessions})
+        # Same auth token as the HTTP API; the user id comes from it, never
+        # from the payload
+        user_id = user_id_from_token(data.get('token'))
+        if not user_id:
+            raise HTTPException(status_code=401, detail="User not authenticated")
+
+        print(f'{sid}: User ID received: {user_id}')
+
+        # A socket logging in as someone else stops receiving the previous
+        # user's events and drops their unfinished attachments
+        previous_user_id = (await sio_server.get_session(sid)).get('user_id')
+        if previous_user_id and previous_user_id != user_id:
+            await sio_server.leave_room(sid, user_room(previous_user_id))
+            _forget_local_sid(previous_user_id, sid)
+            discard_attachments(sid)
+
+        await set_online(user_id, sid)
+        local_user_sids.setdefault(user_id, set()).add(sid)
+
+        matched_user_ids = await run_in_db_executor(_matched_user_ids, user_id)
+        await sio_server.save_session(sid, {
+            'user_id': user_id,
+            'matched_user_ids': matched_user_ids,
+            'match_cache': MatchCache()
+        })
+        await sio_server.enter_room(sid, user_room(user_id))
+
+        await _broadcast_presence(user_id, matched_user_ids, 'ONLINE')
+        # The new socket gets the first page of its own matches' presence
+        await sio_server.emit(
+            'join', await _presence_page(matched_user_ids, 1, PRESENCE_PAGE_SIZE), to=sid)
         print(f'{user_id} connected')
 
     except HTTPException as e:
@@ -59,6 +151,147 @@ async def login(sid, data):
 
 
 @sio_server.event
+async def presence_snapshot(sid, data):
+    # Acknowledged with one page of the caller's matches that are online
+    session = await sio_server.get_session(sid)
+    data = data if isinstance(data, dict) else {}
+    try:
+        page = max(int(data.get('page', 1)), 1)
+        page_size = min(max(int(data.get('page_size', PRESENCE_PAGE_SIZE)), 1), PRESENCE_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return {"error": "page and page_size must be integers"}
+    return await _presence_page(session.get('matched_user_ids', []), page, page_size)
+
+
+# Users whose matches entered or left ACTIVE and still need their sockets'
+# matched_user_ids recomputed; one task drains it, so repeated
+# invalidations for a user cost one query
+_match_refresh_pending = set()
+_match_refresh_running = False
+
+
+async def _refresh_matched_user_ids():
+    global _match_refresh_running
+    try:
+        while _match_refresh_pending:
+            user_id = _match_refresh_pending.pop()
+            sids = list(local_user_sids.get(user_id, ()))
+            if not sids:
+                continue
+            try:
+                matched_user_ids = await run_in_db_executor(_matched_user_ids, user_id)
+            except Exception as e:
+                print(f"Refreshing matches of {user_id} failed: {e}")
+                continue
+            for sid in sids:
+                try:
+                    async with sio_server.session(sid) as session:
+                        if session.get('user_id') == user_id:
+                            session['matched_user_ids'] = matched_user_ids
+                except KeyError:
+                    # Disconnected meanwhile
+                    pass
+    finally:
+        _match_refresh_running = False
+
+
+def _on_matches_invalidated(pair_keys):
+    # Called for pairs that entered or left ACTIVE, e.g. an accepted request
+    global _match_refresh_running
+    _match_refresh_pending.update({
+        user_id for pair_key in pair_keys for user_id in pair_key.split(':')
+    } & local_user_sids.keys())
+    if _match_refresh_pending and not _match_refresh_running:
+        _match_refresh_running = True
+        sio_server.start_background_task(_refresh_matched_user_ids)
+
+
+on_invalidate(_on_matches_invalidated)
+
+
+def _active_match(current_user_id: str, message_user_id: str):
+    # The pair's match, detached from its session, when it is ACTIVE; else None
+    with get_db_socket() as db:
+        existing_match = db.query(Match).filter(
+            Match.pair_key == make_pair_key(current_user_id, message_user_id)
+        ).first()
+
+        if existing_match is None:
+            print("No match found between these users")
+            return None
+        elif existing_match.status != MatchStatus.ACTIVE:
+            print("Can't send a message to the user whom you are not actively matched with")
+            return None
+        db.expunge(existing_match)
+        return existing_match
+
+
+def _save_message(existing_match: Match, current_user_id: str, message_user_id: str,
+                  chat_message, file_url, file_type: str) -> dict:
+    with get_db_socket() as db:
+        new_message = Message(
+            id=str(uuid.uuid4()),
+            match_id=existing_match.id,
+            sender_id=current_user_id,
+            recipient_id=message_user_id,
+            content=chat_message,
+            file_url=file_url,
+            content_type=file_type
+        )
+        db.add(new_message)
+        unread_count, unread_version = record_message(db, existing_match, new_message)
+        db.commit()
+        db.refresh(new_message)
+        set_unread(message_user_id, current_user_id, unread_count, unread_version)
+
+        return {
+            "id": str(new_message.id),
+            "match_id": str(new_message.match_id),
+            "sender_id": str(new_message.sender_id),
+            "recipient_id": str(new_message.recipient_id),
+            "content": new_message.content,
+            "content_type": str(new_message.content_type),
+            "file_url": new_message.file_url,
+            "seen": new_message.seen,
+            "created_at": new_message.created_at.isoformat(),
+            "updated_at": new_message.updated_at.isoformat()
+        }
+
+
+async def _authorized_match(session, current_user_id: str, message_user_id: str):
+    # Pairs this socket already chatted in skip the match lookup;
+    # status changes invalidate them (utils/match_cache.py)
+    pair_key = make_pair_key(current_user_id, message_user_id)
+    match_cache = session['match_cache']
+    existing_match = match_cache.get(pair_key)
+    if existing_match is None:
+        generation = current_generation()
+        # Blocking DB work runs on the DB executor, never on the event loop
+        existing_match = await run_in_db_executor(
+            _active_match, current_user_id, message_user_id)
+        if existing_match is not None:
+            match_cache.put(pair_key, existing_match, generation)
+    return existing_match
+
+
+async def _deliver_message(message_dict: dict, current_user_id: str, message_user_id: str):
+    # Deliver to the two participants only
+    await sio_server.emit("chat", message_dict, to=[
+        user_room(current_user_id), user_room(message_user_id)])
+
+    await sio_server.emit("chat_message", {
+        "sender_id": current_user_id,
+        "recipient_id": message_user_id,
+        "content": message_dict["content"]
+    }, to=user_room(message_user_id))
+
+
+def _attachment_folder(current_user_id: str, message_user_id: str) -> str:
+    return current_user_id + "..." + message_user_id
+
+
+@sio_server.event
+@timed_handler
 async def chat(sid, data):
     try:
         if data and isinstance(data, dict):
@@ -67,94 +300,41 @@ async def chat(sid, data):
             chat_message = data.get('message')
             file = data.get('file')
 
+            # Only the user logged in on this socket may send as themselves
+            session = await sio_server.get_session(sid)
+            if current_user_id != session.get('user_id'):
+                print(f"{sid}: chat rejected, socket is not logged in as {current_user_id}")
+                return
+
             if current_user_id and message_user_id:
-                with get_db_socket() as db:
-                    existing_match = db.query(Match).filter(
-                        or_(
-                            and_(Match.user1_id == current_user_id,
-                                 Match.user2_id == message_user_id),
-                            and_(
-                                Match.user1_id == message_user_id,
-                                Match.user2_id == current_user_id,
-                            )
+                existing_match = await _authorized_match(
+                    session, current_user_id, message_user_id)
+                if existing_match is None:
+                    return
+
+                file_url = None
+                file_type = "text"
+
+                if file is not None:
+                    # Legacy base64 attachments; new clients use the
+                    # attachment_start/chunk/commit events below
+                    try:
+                        file_url = await store_file_async(
+                            base64.b64decode(file),
+                            data.get('filename', 'file'),
+                            data.get('content_type', 'image/jpg'),
+                            'message_file',
+                            _attachment_folder(current_user_id, message_user_id)
                         )
-                    ).first()
-
-                    if existing_match is None:
-                        print("No match found between these users")
-                        return
-                    elif existing_match.status != MatchStatus.ACTIVE:
-                        print(
-                            "Can't send a message to the user whom you are not actively matched with")
-                        return
-
-                    file_url = None
-                    file_type = "text"
-
-                    if file is not None:
-                        try:
-                            class MockUploadFile:
-                                def __init__(self, content, filename, content_type):
-                                    self.content = content
-                                    self.filename = filename
-                                    self.content_type = content_type
-
-                                async def read(self):
-                                    return self.content
-
-                            decoded_file = base64.b64decode(file)
-                            mock_file = MockUploadFile(
-                                content=decoded_file,
-                                filename=data.get('filename', 'file'),
-                                content_type=data.get(
-                                    'content_type', 'image/jpg')
-                            )
-
-                            file_url = await upload_to_supabase(
-                                mock_file,
-                                'message_file',
-                                current_user_id + "..." + message_user_id
-                            )
-                            file_type = "file"
-                        except Exception as e:
-                            print(f"File upload error: {str(e)}")
-                            # Handle the error appropriately
-
-                    new_message = Message(
-                        id=str(uuid.uuid4()),
-                        match_id=existing_match.id,
-                        sender_id=current_user_id,
-                        recipient_id=message_user_id,
-                        content=chat_message,
-                        file_url=file_url,
-                        content_type=file_type
-                    )
-                    db.add(new_message)
-                    db.commit()
-                    db.refresh(new_message)
-
-                    message_dict = {
-                        "id": str(new_message.id),
-                        "match_id": str(new_message.match_id),
-                        "sender_id": str(new_message.sender_id),
-                        "recipient_id": str(new_message.recipient_id),
-                        "content": new_message.content,
-                        "content_type": str(new_message.content_type),
-                        "file_url": new_message.file_url,
-                        "seen": new_message.seen,
-                        "created_at": new_message.created_at.isoformat(),
-                        "updated_at": new_message.updated_at.isoformat()
-                    }
-
-                    await sio_server.emit("chat", message_dict)
-
-                    if message_user_id in user_sessions:
-                        recipient_socket_id = user_sessions[message_user_id]['socket_id']
-                        await sio_server.emit("chat_message", {
-                            "sender_id": current_user_id,
-                            "recipient_id": message_user_id,
-                            "content": chat_message
-                        }, room=recipient_socket_id)
+                        file_type = "file"
+                    except Exception as e:
+                        print(f"File upload error: {str(e)}")
+                        # Handle the error appropriately
+
+                message_dict = await run_in_db_executor(
+                    _save_message, existing_match, current_user_id, message_user_id,
+                    chat_message, file_url, file_type)
+                await _deliver_message(message_dict, current_user_id, message_user_id)
 
     except HTTPException as e:
         await sio_server.disconnect(sid)
@@ -162,47 +342,184 @@ async def chat(sid, data):
 
 
 @sio_server.event
+@timed_handler
+async def attachment_start(sid, data):
+    """Begin a chunked attachment. Acknowledged with the attachment id and the
+    chunk size to use, or an error."""
+    data = data if isinstance(data, dict) else {}
+    try:
+        session = await sio_server.get_session(sid)
+        current_user_id = session.get('user_id')
+        message_user_id = data.get('message_user_id')
+        if not current_user_id or not message_user_id:
+            return {"error": "Not logged in"}
+
+        existing_match = await _authorized_match(
+            session, current_user_id, message_user_id)
+        if existing_match is None:
+            return {"error": "You are not actively matched with this user"}
+
+        attachment = start_attachment(
+            sid, current_user_id, message_user_id, existing_match,
+            data.get('filename', 'file'),
+            data.get('content_type', 'application/octet-stream'),
+            int(data.get('size', 0))
+        )
+        return {"attachment_id": attachment.id, "chunk_size": ATTACHMENT_CHUNK_SIZE}
+    except (AttachmentError, ValueError) as e:
+        return {"error": str(e)}
+
+
+@sio_server.event
+async def attachment_chunk(sid, data):
+    # data: {attachment_id, seq, data: <binary>}; chunks may be sent without
+    # waiting for each other's acks
+    data = data if isinstance(data, dict) else {}
+    try:
+        attachment = get_attachment(sid, data.get('attachment_id'))
+        await attachment.write_chunk(int(data.get('seq', -1)), data.get('data') or b'')
+        return {"received": len(attachment.received)}
+    except (AttachmentError, ValueError, TypeError, OSError) as e:
+        return {"error": str(e)}
+
+
+@sio_server.event
+@timed_handler
+async def attachment_commit(sid, data):
+    """Upload a fully received attachment and send it as a chat message.
+    Acknowledged with the message, which is also emitted as a normal chat."""
+    data = data if isinstance(data, dict) else {}
+    attachment = None
+    try:
+        attachment = get_attachment(sid, data.get('attachment_id'))
+        if not attachment.complete:
+            attachment = None
+            return {"error": "Attachment is missing chunks"}
+        pop_attachment(sid, attachment.id)
+
+        # Uploaded straight from the spool file by a worker thread
+        file_url = await store_file_async(
+            attachment.path,
+            attachment.filename,
+            attachment.content_type,
+            'message_file',
+            _attachment_folder(attachment.sender_id, attachment.recipient_id)
+        )
+        message_dict = await run_in_db_executor(
+            _save_message, attachment.match, attachment.sender_id, attachment.recipient_id,
+            data.get('message'), file_url, "file")
+        await _deliver_message(message_dict, attachment.sender_id, attachment.recipient_id)
+        return {"message": message_dict}
+    except AttachmentError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        print(f"Attachment upload error: {e}")
+        return {"error": "Attachment upload failed"}
+    finally:
+        if attachment is not None:
+            attachment.discard()
+
+
+@sio_server.event
+async def attachment_abort(sid, data):
+    data = data if isinstance(data, dict) else {}
+    discard_attachments(sid, data.get('attachment_id'))
+
+
+def _mark_read(current_user_id: str, sender_id: str):
+    with get_db_socket() as db:
+        # Move the read watermark instead of flagging every unread row
+        unread_version = mark_read(db, current_user_id, sender_id)
+        db.commit()
+    if unread_version is not None:
+        set_unread(current_user_id, sender_id, 0, unread_version)
+
+
+@sio_server.event
+@timed_handler
 async def mark_messages_seen(sid, data):
     try:
         if data and isinstance(data, dict):
-            current_user_id = data.get('current_user_id')
+            # The reader is whoever is logged in on this socket
+            session = await sio_server.get_session(sid)
+            current_user_id = session.get('user_id')
             sender_id = data.get('sender_id')
+            if not current_user_id or not sender_id:
+                return
+
+            await run_in_db_executor(_mark_read, current_user_id, sender_id)
 
-            with get_db_socket() as db:
-                # Update messages as seen
-                db.query(Message).filter(
-                    Message.sender_id == sender_id,
-                    Message.recipient_id == current_user_id,
-                    Message.seen == False
-                ).update({"seen": True})
-                db.commit()
-
-                # Emit message_seen event to sender
-                if sender_id in user_sessions:
-                    sender_socket_id = user_sessions[sender_id]['socket_id']
-                    await sio_server.emit("message_seen", {
-                        "sender_id": sender_id,
-                        "reader_id": current_user_id
-                    }, room=sender_socket_id)
+            # Emit message_seen event to sender
+            await sio_server.emit("message_seen", {
+                "sender_id": sender_id,
+                "reader_id": current_user_id
+            }, to=user_room(sender_id))
 
     except Exception as e:
         print(f"Error marking messages as seen: {e}")
 
 
+def _forget_local_sid(user_id: str, sid: str):
+    sids = local_user_sids.get(user_id)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del local_user_sids[user_id]
+
+
+@sio_server.event
+async def heartbeat(sid, data=None):
+    # Optional client keepalive; connected sockets are also refreshed by
+    # the per-process heartbeat task below
+    session = await sio_server.get_session(sid)
+    user_id = session.get('user_id')
+    if user_id:
+        await refresh_online({user_id: sid})
+
+
+async def _presence_heartbeat():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+        try:
+            await refresh_online({
+                user_id: next(iter(sids))
+                for user_id, sids in local_user_sids.items() if sids
+            })
+        except Exception as e:
+            print(f"Presence heartbeat failed: {e}")
+
+
+def start_presence_heartbeat():
+    # Called on app startup, once the event loop is running
+    sio_server.start_background_task(_presence_heartbeat)
+
+
 @sio_server.event
 async def disconnect(sid):
     print(f'{sid}: disconnecting')
+    # A dropped socket stops being refreshed; its presence entry expires
+    # unless the user is still connected elsewhere
+    session = await sio_server.get_session(sid)
+    if session.get('user_id'):
+        _forget_local_sid(session['user_id'], sid)
+    discard_attachments(sid)
 
 
 @sio_server.event
+@timed_handler
 async def logout(sid, data):
     user_id = data.get('user_id')
-    if user_id in user_sessions:
-        user_sessions[user_id]['status'] = 'OFFLINE'
-        user_sessions[user_id]['timestamp'] = datetime.now().isoformat()
-        await sio_server.emit('leave', {'user_id': user_id})
+    session = await sio_server.get_session(sid)
+    await sio_server.leave_room(sid, user_room(user_id))
+    if user_id == session.get('user_id'):
+        _forget_local_sid(user_id, sid)
+        await set_offline(user_id)
+        matched_user_ids = session.get('matched_user_ids', [])
+        await _broadcast_presence(user_id, matched_user_ids, 'OFFLINE')
+        if matched_user_ids:
+            await sio_server.emit('leave', {'user_id': user_id}, to=[
+                user_room(matched_user_id) for matched_user_id in matched_user_ids])
         print(f'{user_id} logged out')
-        print(f'Users connected === {user_sessions}')
 
 app = Starlette(debug=True)
 app.mount('/sockets/', sio_server)
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import tempfile
+import uuid
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Chat attachments arrive as binary socket events of ATTACHMENT_CHUNK_SIZE
+# bytes (the last one may be shorter) and are spooled to a temp file
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024))
+MAX_UPLOADS_PER_SOCKET = 3
+
+
+class AttachmentError(Exception):
+    pass
+
+
+class Attachment:
+    """One attachment being received: its spool file and which chunks arrived."""
+
+    def __init__(self, sid: str, sender_id: str, recipient_id: str, match,
+                 filename: str, content_type: str, size: int):
+        self.id = str(uuid.uuid4())
+        self.sid = sid
+        self.sender_id = sender_id
+        self.recipient_id = recipient_id
+        self.match = match
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.chunk_count = max(-(-size // ATTACHMENT_CHUNK_SIZE), 1)
+        self.received = set()
+        fd, self.path = tempfile.mkstemp(prefix="attachment-")
+        self.fd = fd
+        # pwrites still running in worker threads; the fd is only closed once
+        # they are done, so none can land in a file that reused the number
+        self._writes_in_flight = 0
+        self.discarded = False
+
+    def _chunk_length(self, seq: int) -> int:
+        if seq == self.chunk_count - 1:
+            return self.size - seq * ATTACHMENT_CHUNK_SIZE
+        return ATTACHMENT_CHUNK_SIZE
+
+    async def write_chunk(self, seq: int, data: bytes):
+        # Chunk events may be handled out of order, so each one is written at
+        # its own offset
+        if self.discarded:
+            raise AttachmentError("Unknown attachment")
+        if not isinstance(data, (bytes, bytearray)):
+            raise AttachmentError("Chunk data must be binary")
+        if not 0 <= seq < self.chunk_count:
+            raise AttachmentError("Chunk out of range")
+        if len(data) != self._chunk_length(seq):
+            raise AttachmentError("Chunk has the wrong size")
+        self._writes_in_flight += 1
+        write = asyncio.ensure_future(
+            asyncio.to_thread(os.pwrite, self.fd, data, seq * ATTACHMENT_CHUNK_SIZE))
+        write.add_done_callback(self._write_done)
+        # Shielded: a cancelled handler must not end the write's count while
+        # the thread is still using the fd
+        await asyncio.shield(write)
+        self.received.add(seq)
+
+    def _write_done(self, write):
+        self._writes_in_flight -= 1
+        if not write.cancelled():
+            # Retrieved here in case the handler awaiting it was cancelled
+            write.exception()
+        if self.discarded and not self._writes_in_flight:
+            os.close(self.fd)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.received) == self.chunk_count
+
+    def discard(self):
+        if self.discarded:
+            return
+        self.discarded = True
+        os.unlink(self.path)
+        # Otherwise the last write in flight closes it
+        if not self._writes_in_flight:
+            os.close(self.fd)
+
+
+# Attachments in progress on this process, by id
+_attachments: Dict[str, Attachment] = {}
+
+
+def start_attachment(sid: str, sender_id: str, recipient_id: str, match,
+                     filename: str, content_type: str, size: int) -> Attachment:
+    if not 0 < size <= ATTACHMENT_MAX_BYTES:
+        raise AttachmentError(f"Attachments must be between 1 and {ATTACHMENT_MAX_BYTES} bytes")
+    if sum(attachment.sid == sid for attachment in _attachments.values()) >= MAX_UPLOADS_PER_SOCKET:
+        raise AttachmentError("Too many attachments in progress")
+    attachment = Attachment(sid, sender_id, recipient_id, match, filename, content_type, size)
+    _attachments[attachment.id] = attachment
+    return attachment
+
+
+def get_attachment(sid: str, attachment_id: str) -> Attachment:
+    attachment = _attachments.get(attachment_id)
+    # Only the socket that started an attachment may add to it
+    if attachment is None or attachment.sid != sid:
+        raise AttachmentError("Unknown attachment")
+    return attachment
+
+
+def pop_attachment(sid: str, attachment_id: str) -> Attachment:
+    attachment = get_attachment(sid, attachment_id)
+    del _attachments[attachment_id]
+    return attachment
+
+
+def discard_attachments(sid: str, attachment_id: Optional[str] = None):
+    # Drop one attachment, or every attachment of a disconnected socket
+    for attachment in list(_attachments.values()):
+        if attachment.sid == sid and attachment_id in (None, attachment.id):
+            del _attachments[attachment.id]
+            attachment.discard()
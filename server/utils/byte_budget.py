@@ -0,0 +1,25 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class ByteBudget:
+    """Caps the total size of uploads in flight. An upload bigger than the
+    whole budget waits until nothing else holds it, then takes all of it."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        size = min(size, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use + size <= self.limit)
+            self.in_use += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= size
+                self._condition.notify_all()
@@ -0,0 +1,130 @@
+from typing import Optional, Tuple
+
+from sqlalchemy import case, select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models.conversation import Conversation
+from models.match import Match, make_pair_key
+from models.message import Message
+
+# Characters of the last message kept for the inbox
+PREVIEW_LENGTH = 200
+
+
+def record_message(db: Session, match: Match, message: Message) -> Tuple[int, int]:
+    """Upsert the match's conversation summary for a new message. Call before
+    committing the message so both land in the same transaction.
+    Sets message.seq. Returns the recipient's unread count and the
+    conversation's unread_version."""
+    insert_stmt = insert(Conversation).values(
+        match_id=match.id,
+        user1_id=match.user1_id,
+        user2_id=match.user2_id,
+        last_message_id=message.id,
+        last_message_preview=message.content[:PREVIEW_LENGTH] if message.content else None,
+        last_message_sender_id=message.sender_id,
+        last_message_at=func.now(),
+        user1_unread_count=int(message.recipient_id == match.user1_id),
+        user2_unread_count=int(message.recipient_id == match.user2_id),
+        unread_version=1,
+        last_message_seq=1,
+    )
+    excluded = insert_stmt.excluded
+    # now() is the transaction start, so an older message can commit after a
+    # newer one; only a message at least as new replaces the preview. The
+    # unread count is incremented either way.
+    newer = Conversation.last_message_at <= excluded.last_message_at
+    row = db.execute(insert_stmt.on_conflict_do_update(
+        index_elements=[Conversation.match_id],
+        set_={
+            "last_message_id": case(
+                (newer, excluded.last_message_id), else_=Conversation.last_message_id),
+            "last_message_preview": case(
+                (newer, excluded.last_message_preview), else_=Conversation.last_message_preview),
+            "last_message_sender_id": case(
+                (newer, excluded.last_message_sender_id), else_=Conversation.last_message_sender_id),
+            "last_message_at": case(
+                (newer, excluded.last_message_at), else_=Conversation.last_message_at),
+            "user1_unread_count": Conversation.user1_unread_count + excluded.user1_unread_count,
+            "user2_unread_count": Conversation.user2_unread_count + excluded.user2_unread_count,
+            "unread_version": Conversation.unread_version + 1,
+            # The row stays locked until commit, so seqs follow commit order
+            "last_message_seq": Conversation.last_message_seq + 1,
+            "updated_at": func.now(),
+        }
+    ).returning(
+        Conversation.user1_unread_count,
+        Conversation.user2_unread_count,
+        Conversation.unread_version,
+        Conversation.last_message_seq,
+    )).one()
+    message.seq = row.last_message_seq
+    if message.recipient_id == match.user1_id:
+        return row.user1_unread_count, row.unread_version
+    return row.user2_unread_count, row.unread_version
+
+
+def mark_read(db: Session, reader_id: str, other_user_id: str) -> Optional[int]:
+    """Move reader_id's watermark to the latest message of their conversation
+    with other_user_id and reset their unread count: one single-row update
+    however many messages were unread. Returns the conversation's new
+    unread_version, or None when they have no conversation yet."""
+    match_id = select(Match.id).where(
+        Match.pair_key == make_pair_key(reader_id, other_user_id)
+    ).scalar_subquery()
+    is_user1 = Conversation.user1_id == reader_id
+    is_user2 = Conversation.user2_id == reader_id
+    return db.execute(
+        update(Conversation)
+        .where(Conversation.match_id == match_id)
+        .values(
+            user1_unread_count=case((is_user1, 0), else_=Conversation.user1_unread_count),
+            user1_last_read_seq=case(
+                (is_user1, Conversation.last_message_seq),
+                else_=Conversation.user1_last_read_seq),
+            user1_last_read_at=case(
+                (is_user1, Conversation.last_message_at),
+                else_=Conversation.user1_last_read_at),
+            user1_last_read_message_id=case(
+                (is_user1, Conversation.last_message_id),
+                else_=Conversation.user1_last_read_message_id),
+            user2_unread_count=case((is_user2, 0), else_=Conversation.user2_unread_count),
+            user2_last_read_seq=case(
+                (is_user2, Conversation.last_message_seq),
+                else_=Conversation.user2_last_read_seq),
+            user2_last_read_at=case(
+                (is_user2, Conversation.last_message_at),
+                else_=Conversation.user2_last_read_at),
+            user2_last_read_message_id=case(
+                (is_user2, Conversation.last_message_id),
+                else_=Conversation.user2_last_read_message_id),
+            unread_version=Conversation.unread_version + 1,
+        )
+        .returning(Conversation.unread_version)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def is_seen(conversation: Optional[Conversation], message: Message) -> bool:
+    """Whether message's recipient has read it, for the API's `seen` field."""
+    if message.seen:
+        # Read before watermarks existed
+        return True
+    if conversation is None:
+        return False
+    if message.recipient_id == conversation.user1_id:
+        last_read_seq = conversation.user1_last_read_seq
+        last_read_at = conversation.user1_last_read_at
+        last_read_message_id = conversation.user1_last_read_message_id
+    else:
+        last_read_seq = conversation.user2_last_read_seq
+        last_read_at = conversation.user2_last_read_at
+        last_read_message_id = conversation.user2_last_read_message_id
+    if message.seq is not None:
+        # Commit order: a message that committed after the read is unseen
+        # even when its created_at is older
+        return last_read_seq is not None and message.seq <= last_read_seq
+    if last_read_at is None:
+        return False
+    return (message.created_at, message.id) <= (last_read_at, last_read_message_id or "")
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import or_, exists, select, tuple_
+from sqlalchemy.orm import Session
+
+from models.match import Match, MatchStatus, pair_key_expression
+from models.user import User
+from models.asset import Asset
+
+# How many filtered candidates the ranking stage scores per request
+RANK_POOL_SIZE = 1000
+
+
+def _years_before(day: datetime, years: int) -> datetime:
+    # Same calendar day `years` earlier; Feb 29 falls back to Feb 28
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def candidate_filters(
+    current_user_id: str,
+    low_age: int,
+    up_age: int,
+    gender: str,
+    passions: List[str],
+    exclude_interacted: bool = True,
+) -> list:
+    """SQL criteria selecting the users that can be suggested to current_user_id.
+
+    exclude_interacted=False leaves out the anti-join against matches for
+    callers that exclude already-swiped users themselves.
+    """
+    # Users the current user already interacted with: any active/rejected
+    # match in either direction, or a pending request the current user sent.
+    # Requests received from others stay visible so they can be answered.
+    already_interacted = exists().where(
+        Match.pair_key == pair_key_expression(current_user_id, User.id),
+        or_(Match.user1_id == current_user_id,
+            Match.status != MatchStatus.UNMATCHED)
+    )
+
+    # Age filter as a dob range so it can use the (gender, dob) index.
+    # Someone is at least low_age once their low_age-th birthday has passed,
+    # and at most up_age until the day of their (up_age + 1)-th birthday.
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    filters = [
+        User.id != current_user_id,
+        User.dob < _years_before(today, low_age) + timedelta(days=1),
+        User.dob >= _years_before(today, up_age + 1) + timedelta(days=1),
+    ]
+    if exclude_interacted:
+        filters.append(~already_interacted)
+
+    # Apply gender filter if gender is not "BOTH"
+    if gender != "BOTH":
+        filters.append(User.gender == gender)
+
+    # Filter profiles based on passions if any are provided. A semi-join
+    # keeps one row per user even when they have several asset rows, and
+    # && (overlap) is served by the GIN index on passion_list.
+    if passions:
+        filters.append(
+            exists().where(
+                Asset.user_id == User.id,
+                Asset.passion_list.overlap(passions)
+            )
+        )
+
+    return filters
+
+
+def user_passions_query(user_id: str):
+    return select(Asset.passion_list).where(Asset.user_id == user_id).limit(1)
+
+
+def user_passions(db: Session, user_id: str) -> List[str]:
+    passion_list = db.execute(user_passions_query(user_id)).scalar()
+    return passion_list or []
+
+
+def candidate_pool_query(filters: list, pool_size: Optional[int] = None,
+                         after: Optional[Tuple[datetime, str]] = None):
+    """(id, dob, updated_at, passion_list) rows for the ranking stage, most
+    recently updated profiles first. Shared by the sync and async callers.
+
+    after is the (updated_at, id) of the last row of the previous page.
+    """
+    passion_list = (
+        select(Asset.passion_list)
+        .where(Asset.user_id == User.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    query = (
+        select(User.id, User.dob, User.updated_at, passion_list)
+        .where(*filters)
+        .order_by(User.updated_at.desc(), User.id.desc())
+        .limit(pool_size or RANK_POOL_SIZE)
+    )
+    if after is not None:
+        query = query.where(tuple_(User.updated_at, User.id) < after)
+    return query
+
+
+def fetch_candidate_pool(db: Session, filters: list, pool_size: Optional[int] = None,
+                         after: Optional[Tuple[datetime, str]] = None):
+    return db.execute(candidate_pool_query(filters, pool_size, after)).all()
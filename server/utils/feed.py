@@ -0,0 +1,157 @@
+import json
+import time
+from typing import List, Optional, Tuple
+
+import redis
+
+from config.database import SessionLocal
+from config.redis_client import redis_client
+from utils.discovery import (
+    RANK_POOL_SIZE, candidate_filters, fetch_candidate_pool, user_passions)
+from utils.ranking import rank_candidates
+from utils.seen_filter import load_seen_filter, might_have_seen
+
+# Ranked candidates kept per user, and the size at which a refill is queued
+FEED_SIZE = 200
+FEED_REFILL_THRESHOLD = 30
+FEED_TTL_SECONDS = 6 * 60 * 60
+
+# Users who requested suggestions within this window get their feed rebuilt
+# by the scheduler, so the next swipe session starts from a warm feed
+ACTIVE_USERS_KEY = "feed:active"
+ACTIVE_WINDOW_SECONDS = 30 * 60
+
+REFILL_LOCK_SECONDS = 60
+
+# Ids popped from the feed recently. A refill queued while a page is still
+# being swiped must not rank that page again: its swipes are not in the
+# Bloom filter yet.
+SERVED_TTL_SECONDS = 30 * 60
+
+
+def _feed_key(user_id: str) -> str:
+    return f"feed:{user_id}"
+
+
+def _params_key(user_id: str) -> str:
+    return f"feed:params:{user_id}"
+
+
+def _lock_key(user_id: str) -> str:
+    return f"feed:lock:{user_id}"
+
+
+def _served_key(user_id: str) -> str:
+    return f"feed:served:{user_id}"
+
+
+def feed_params(low_age: int, up_age: int, gender: str, passions: List[str]) -> str:
+    # Serialized discovery filters; a feed is only valid for the filters it was built with
+    return json.dumps({
+        "low_age": low_age,
+        "up_age": up_age,
+        "gender": gender,
+        "passions": sorted(passions),
+    }, sort_keys=True)
+
+
+def build_feed(db, user_id: str, params: str) -> int:
+    """Rank candidates for user_id and replace their feed. Returns the feed size."""
+    filters_args = json.loads(params)
+    passions = filters_args["passions"]
+    # Already-swiped users are dropped with the user's Bloom filter instead of
+    # an anti-join against matches; hydration re-checks the few ids served
+    filters = candidate_filters(
+        user_id,
+        filters_args["low_age"],
+        filters_args["up_age"],
+        filters_args["gender"],
+        passions,
+        exclude_interacted=False,
+    )
+    seen = load_seen_filter(db, user_id)
+    served = redis_client.smembers(_served_key(user_id))
+    # Heavy swipers may have seen most of one page, so keep paging until
+    # there is a feed's worth of unseen candidates or the pool runs out
+    candidates = []
+    after = None
+    while len(candidates) < FEED_SIZE:
+        page = fetch_candidate_pool(db, filters, 2 * RANK_POOL_SIZE, after)
+        candidates.extend(
+            candidate for candidate in page
+            if candidate[0] not in served and not might_have_seen(seen, candidate[0])
+        )
+        if len(page) < 2 * RANK_POOL_SIZE:
+            break
+        after = (page[-1].updated_at, page[-1].id)
+    ranked = rank_candidates(
+        candidates,
+        passions or user_passions(db, user_id),
+        filters_args["low_age"],
+        filters_args["up_age"],
+        FEED_SIZE,
+    )
+
+    pipe = redis_client.pipeline()
+    pipe.delete(_feed_key(user_id))
+    if ranked:
+        pipe.zadd(_feed_key(user_id), dict(ranked))
+        pipe.expire(_feed_key(user_id), FEED_TTL_SECONDS)
+    pipe.set(_params_key(user_id), params, ex=FEED_TTL_SECONDS)
+    pipe.execute()
+    return len(ranked)
+
+
+def build_feed_with_session(user_id: str, params: str) -> int:
+    # For callers without a sync session of their own (threads, async routes)
+    db = SessionLocal()
+    try:
+        return build_feed(db, user_id, params)
+    finally:
+        db.close()
+
+
+def refill_feed(user_id: str, params: str):
+    # Runs off the request path; skip if another refill is already in flight
+    if not redis_client.set(_lock_key(user_id), 1, nx=True, ex=REFILL_LOCK_SECONDS):
+        return
+    try:
+        build_feed_with_session(user_id, params)
+    except Exception as e:
+        print(f"Feed refill failed for user {user_id}: {e}")
+    finally:
+        redis_client.delete(_lock_key(user_id))
+
+
+def pop_feed(user_id: str, params: str, count: int) -> Tuple[Optional[List[str]], int]:
+    """Pop the next `count` ids from the feed. Returns (None, 0) when there is
+    no feed for these filters, otherwise (ids, remaining)."""
+    redis_client.zadd(ACTIVE_USERS_KEY, {user_id: time.time()})
+
+    if redis_client.get(_params_key(user_id)) != params:
+        return None, 0
+
+    pipe = redis_client.pipeline()
+    pipe.zpopmax(_feed_key(user_id), count)
+    pipe.zcard(_feed_key(user_id))
+    popped, remaining = pipe.execute()
+    served_ids = [served_id for served_id, _ in popped]
+    if served_ids:
+        pipe = redis_client.pipeline()
+        pipe.sadd(_served_key(user_id), *served_ids)
+        pipe.expire(_served_key(user_id), SERVED_TTL_SECONDS)
+        pipe.execute()
+    return served_ids, remaining
+
+
+def refresh_active_feeds():
+    # Scheduled job: rebuild feeds of recently active users ahead of their next swipe
+    try:
+        cutoff = time.time() - ACTIVE_WINDOW_SECONDS
+        redis_client.zremrangebyscore(ACTIVE_USERS_KEY, "-inf", cutoff)
+        for user_id in redis_client.zrange(ACTIVE_USERS_KEY, 0, -1):
+            params = redis_client.get(_params_key(user_id))
+            if params and redis_client.zcard(_feed_key(user_id)) < FEED_REFILL_THRESHOLD:
+                refill_feed(user_id, params)
+    except redis.RedisError as e:
+        print(f"Feed refresh failed: {e}")
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import time
+from functools import wraps
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How often the loop is sampled, and the lag / handler time worth logging
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+LOOP_LAG_WARN_SECONDS = float(os.getenv('LOOP_LAG_WARN_SECONDS', 0.1))
+HANDLER_WARN_SECONDS = float(os.getenv('HANDLER_WARN_SECONDS', 1.0))
+
+# Samples per max-lag report: one report a minute
+LOOP_LAG_REPORT_EVERY = 120
+
+# Worst lag seen since the last report
+loop_lag_stats = {'max_lag': 0.0, 'samples': 0}
+
+
+async def _monitor_loop_lag():
+    # A sleep that wakes up late means something blocked the event loop
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        lag = time.perf_counter() - started - LOOP_LAG_INTERVAL_SECONDS
+        if lag > LOOP_LAG_WARN_SECONDS:
+            print(f"Event loop blocked for {lag * 1000:.0f} ms")
+
+        loop_lag_stats['max_lag'] = max(loop_lag_stats['max_lag'], lag)
+        loop_lag_stats['samples'] += 1
+        if loop_lag_stats['samples'] >= LOOP_LAG_REPORT_EVERY:
+            print(f"Event loop max lag over the last minute: "
+                  f"{loop_lag_stats['max_lag'] * 1000:.0f} ms")
+            loop_lag_stats['max_lag'] = 0.0
+            loop_lag_stats['samples'] = 0
+
+
+def start_loop_lag_monitor():
+    # Called on app startup, once the event loop is running
+    asyncio.get_running_loop().create_task(_monitor_loop_lag())
+
+
+def timed_handler(handler):
+    """Log socket event handlers that take longer than HANDLER_WARN_SECONDS."""
+    @wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed > HANDLER_WARN_SECONDS:
+                print(f"Socket handler {handler.__name__} took {elapsed * 1000:.0f} ms")
+    return wrapper
@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Set
+
+import redis
+
+from config.redis_client import async_redis_client, redis_client
+
+# Per-socket cache of ACTIVE matches the socket has chatted in, so steady-state
+# chat sends skip the match lookup. Entries expire after MATCH_CACHE_TTL_SECONDS
+# even if an invalidation is lost, which bounds how stale a cache can be.
+MATCH_CACHE_SIZE = 256
+MATCH_CACHE_TTL_SECONDS = 60
+
+# Pair keys whose match entered or left ACTIVE are published here for every
+# process, as "<process id>|<pair key>,<pair key>..."
+INVALIDATION_CHANNEL = "match:invalidate"
+
+# Lets the listener skip what this process published; it already applied it
+_PROCESS_ID = uuid.uuid4().hex
+
+# Every live cache in this process by id, and the ids of the caches holding
+# each pair key, so an invalidation only touches caches that hold the pair
+_caches = weakref.WeakValueDictionary()
+_caches_by_pair: Dict[str, Set[int]] = {}
+_cache_ids = itertools.count()
+
+# Bumped on each invalidation; a lookup that started before an invalidation
+# must not repopulate the cache with what it read
+_generation = 0
+
+# Event loop the socket handlers (and so the caches) run on
+_loop = None
+
+# Called on the event loop with the pair keys of every invalidation
+_listeners: List[Callable[[List[str]], None]] = []
+
+
+class MatchCache:
+    """Bounded LRU of pair_key -> ACTIVE match, with a TTL per entry."""
+
+    def __init__(self, max_size: int = MATCH_CACHE_SIZE, ttl: float = MATCH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._id = next(_cache_ids)
+        _caches[self._id] = self
+        # Caches die with their socket session; drop them from the index then
+        weakref.finalize(self, _unindex, self._id, self._entries)
+
+    def get(self, pair_key: str):
+        entry = self._entries.get(pair_key)
+        if entry is None:
+            return None
+        match, expires_at = entry
+        if expires_at < time.monotonic():
+            self.discard(pair_key)
+            return None
+        self._entries.move_to_end(pair_key)
+        return match
+
+    def put(self, pair_key: str, match, generation: int):
+        if generation != _generation:
+            return
+        self._entries[pair_key] = (match, time.monotonic() + self.ttl)
+        self._entries.move_to_end(pair_key)
+        _caches_by_pair.setdefault(pair_key, set()).add(self._id)
+        while len(self._entries) > self.max_size:
+            evicted_key, _ = self._entries.popitem(last=False)
+            _unindex(self._id, [evicted_key])
+
+    def discard(self, pair_key: str):
+        if self._entries.pop(pair_key, None) is not None:
+            _unindex(self._id, [pair_key])
+
+    def clear(self):
+        _unindex(self._id, self._entries)
+        self._entries.clear()
+
+
+def _unindex(cache_id: int, pair_keys: Iterable[str]):
+    for pair_key in list(pair_keys):
+        cache_ids = _caches_by_pair.get(pair_key)
+        if cache_ids is not None:
+            cache_ids.discard(cache_id)
+            if not cache_ids:
+                del _caches_by_pair[pair_key]
+
+
+def current_generation() -> int:
+    # Read before a lookup and pass to MatchCache.put
+    return _generation
+
+
+def on_invalidate(listener: Callable[[List[str]], None]):
+    # For other per-socket state derived from matches
+    _listeners.append(listener)
+
+
+def _invalidate_local(pair_keys: List[str]):
+    global _generation
+    _generation += 1
+    for pair_key in pair_keys:
+        for cache_id in list(_caches_by_pair.get(pair_key, ())):
+            cache = _caches.get(cache_id)
+            if cache is not None:
+                cache.discard(pair_key)
+    for listener in _listeners:
+        try:
+            listener(pair_keys)
+        except Exception as e:
+            print(f"Match invalidation listener failed: {e}")
+
+
+def _invalidate_all():
+    global _generation
+    _generation += 1
+    for cache in list(_caches.values()):
+        cache.clear()
+
+
+def invalidate_matches(pair_keys: Iterable[str]):
+    """Drop pairs whose match entered or left ACTIVE from every process's
+    caches. Call after the change is committed; safe to call from any thread."""
+    pair_keys = list(pair_keys)
+    if not pair_keys:
+        return
+    # Caches are only touched on the event loop, so hand the local
+    # invalidation to it; other processes get it over Redis
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_invalidate_local, pair_keys)
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, f"{_PROCESS_ID}|{','.join(pair_keys)}")
+    except redis.RedisError as e:
+        # Other processes fall back on the cache TTL
+        print(f"Match cache invalidation publish failed: {e}")
+
+
+async def _listen_for_invalidations():
+    while True:
+        pubsub = async_redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    origin, _, pair_keys = message["data"].partition("|")
+                    if origin != _PROCESS_ID:
+                        _invalidate_local(pair_keys.split(","))
+        except Exception as e:
+            print(f"Match cache invalidation listener failed: {e}")
+            # Whatever was missed while disconnected may be stale
+            _invalidate_all()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+def start_match_invalidation_listener():
+    # Called on app startup, once the event loop is running
+    global _loop
+    _loop = asyncio.get_running_loop()
+    _loop.create_task(_listen_for_invalidations())
@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Dict, Iterable
+
+from config.redis_client import async_redis_client
+
+# An ONLINE entry lives this long unless refreshed by a heartbeat, so users on
+# a worker that died drop out of presence on their own
+PRESENCE_TTL_SECONDS = 90
+HEARTBEAT_INTERVAL_SECONDS = 30
+
+# OFFLINE entries are kept a while so matches can still see when the user left
+OFFLINE_TTL_SECONDS = 24 * 60 * 60
+
+
+def _key(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+async def set_online(user_id: str, sid: str):
+    pipe = async_redis_client.pipeline()
+    pipe.hset(_key(user_id), mapping={
+        'socket_id': sid,
+        'status': 'ONLINE',
+        'timestamp': datetime.now().isoformat()
+    })
+    pipe.expire(_key(user_id), PRESENCE_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def set_offline(user_id: str):
+    pipe = async_redis_client.pipeline()
+    pipe.hset(_key(user_id), mapping={
+        'status': 'OFFLINE',
+        'timestamp': datetime.now().isoformat()
+    })
+    pipe.expire(_key(user_id), OFFLINE_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def refresh_online(user_sids: Dict[str, str]):
+    # Heartbeat for users still connected to this process: extend their TTL,
+    # recreating the entry if it expired while the loop was busy
+    if not user_sids:
+        return
+    pipe = async_redis_client.pipeline()
+    for user_id, sid in user_sids.items():
+        pipe.hset(_key(user_id), mapping={'socket_id': sid, 'status': 'ONLINE'})
+        pipe.hsetnx(_key(user_id), 'timestamp', datetime.now().isoformat())
+        pipe.expire(_key(user_id), PRESENCE_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def get_presence(user_ids: Iterable[str]) -> Dict[str, dict]:
+    """Presence entries ({'socket_id', 'status', 'timestamp'}) of the given
+    users that have one, in the shape the old user_sessions map used."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    pipe = async_redis_client.pipeline()
+    for user_id in user_ids:
+        pipe.hgetall(_key(user_id))
+    entries = await pipe.execute()
+    return {user_id: entry for user_id, entry in zip(user_ids, entries) if entry}
@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Relative weight of each signal in the final score
+PASSION_WEIGHT = 0.5
+AGE_WEIGHT = 0.3
+RECENCY_WEIGHT = 0.2
+
+# Profiles updated this many days ago get half the recency score
+RECENCY_HALF_LIFE_DAYS = 14.0
+
+# Number of set bits for every possible byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def _passion_bitmasks(passion_lists: Sequence[Optional[Sequence[str]]], vocabulary: dict) -> np.ndarray:
+    # One row per candidate, one bit per passion in the vocabulary, packed into bytes
+    bits = np.zeros((len(passion_lists), len(vocabulary)), dtype=bool)
+    for row, passions in enumerate(passion_lists):
+        for passion in passions or ():
+            bits[row, vocabulary[passion]] = True
+    return np.packbits(bits, axis=1)
+
+
+def _ages(dobs: Sequence[datetime], today: datetime) -> np.ndarray:
+    years = np.array([dob.year for dob in dobs], dtype=np.int32)
+    month_days = np.array([dob.month * 100 + dob.day for dob in dobs], dtype=np.int32)
+    before_birthday = month_days > today.month * 100 + today.day
+    return today.year - years - before_birthday
+
+
+def rank_candidates(
+    candidates: Sequence[Tuple[str, datetime, datetime, Optional[Sequence[str]]]],
+    passions: Sequence[str],
+    low_age: int,
+    up_age: int,
+    top_k: int,
+    now: Optional[datetime] = None,
+) -> List[Tuple[str, float]]:
+    """Score (id, dob, updated_at, passion_list) candidates and return the
+    top_k (id, score) pairs, best first."""
+    if not candidates:
+        return []
+    now = now or datetime.now()
+
+    ids = [candidate[0] for candidate in candidates]
+    dobs = [candidate[1] for candidate in candidates]
+    updated_ats = [candidate[2] for candidate in candidates]
+    passion_lists = [candidate[3] for candidate in candidates]
+
+    # Passion overlap: Jaccard similarity between bitmasks over a shared vocabulary
+    vocabulary = {}
+    for passion in passions:
+        vocabulary.setdefault(passion, len(vocabulary))
+    for candidate_passions in passion_lists:
+        for passion in candidate_passions or ():
+            vocabulary.setdefault(passion, len(vocabulary))
+
+    if passions and vocabulary:
+        masks = _passion_bitmasks(passion_lists, vocabulary)
+        wanted = _passion_bitmasks([passions], vocabulary)[0]
+        intersection = _POPCOUNT[masks & wanted].sum(axis=1)
+        union = _POPCOUNT[masks | wanted].sum(axis=1)
+        passion_score = np.divide(intersection, union, out=np.zeros(len(ids)), where=union > 0)
+    else:
+        passion_score = np.zeros(len(ids))
+
+    # Age: 1 at the midpoint of the requested range, falling to 0 at its edges
+    midpoint = (low_age + up_age) / 2
+    half_range = max((up_age - low_age) / 2, 1)
+    age_distance = np.abs(_ages(dobs, now) - midpoint) / half_range
+    age_score = np.clip(1 - age_distance, 0, 1)
+
+    # Recency: exponential decay on days since the profile was last updated
+    updated_seconds = np.array([updated_at.timestamp() for updated_at in updated_ats])
+    days_since_update = np.maximum(now.timestamp() - updated_seconds, 0) / 86400
+    recency_score = np.exp2(-days_since_update / RECENCY_HALF_LIFE_DAYS)
+
+    scores = (PASSION_WEIGHT * passion_score
+              + AGE_WEIGHT * age_score
+              + RECENCY_WEIGHT * recency_score)
+
+    top_k = min(top_k, len(ids))
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(ids[index], float(scores[index])) for index in best]
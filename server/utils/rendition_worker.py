@@ -0,0 +1,35 @@
+import os
+import tempfile
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+# Runs in the rendition worker processes (utils/renditions.py). Those import
+# this module afresh, so it only depends on Pillow, not on the app's config.
+
+# Longest-side bounds of the WebP renditions made for every uploaded photo;
+# aspect ratio is kept and images are never upscaled
+RENDITION_SIZES = {
+    "thumb": (160, 160),
+    "card": (720, 960),
+}
+RENDITION_QUALITY = 80
+
+
+def render_renditions(source_path: str) -> Dict[str, str]:
+    """Write one WebP file per RENDITION_SIZES entry and return their paths.
+    Runs in a worker process."""
+    paths = {}
+    with Image.open(source_path) as image:
+        # Phones store rotation in EXIF; bake it in before resizing
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for name, size in RENDITION_SIZES.items():
+            rendition = image.copy()
+            rendition.thumbnail(size, Image.LANCZOS)
+            fd, path = tempfile.mkstemp(prefix=f"rendition-{name}-", suffix=".webp")
+            with os.fdopen(fd, "wb") as output:
+                rendition.save(output, "WEBP", quality=RENDITION_QUALITY, method=4)
+            paths[name] = path
+    return paths
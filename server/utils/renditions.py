@@ -0,0 +1,109 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import UploadFile
+
+from config.database import run_in_db_executor
+from config.supabase_client import store_file_async
+from utils.byte_budget import ByteBudget
+from utils.rendition_worker import render_renditions
+from utils.stored_objects import (
+    claim_stored_object, record_stored_object, release_stored_objects, spool_and_hash)
+
+load_dotenv()
+
+# Resizing is CPU-bound, so it runs in worker processes rather than threads
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", 2))
+_rendition_executor = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    # Created on first use so importing this module never starts processes.
+    # Workers come from a forkserver rather than forking this process, which
+    # holds an event loop, DB pools and Redis connections. The forkserver
+    # would preload __main__ (main.py with its routes, engines and sockets),
+    # so it preloads only the worker module instead.
+    global _rendition_executor
+    if _rendition_executor is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["utils.rendition_worker"])
+        _rendition_executor = ProcessPoolExecutor(
+            max_workers=RENDITION_WORKERS,
+            mp_context=context,
+        )
+    return _rendition_executor
+
+
+async def _store_renditions(source_path: str, filename: str, file_type: str, user_id: str,
+                            request_budget: Optional[ByteBudget]) -> Dict[str, str]:
+    loop = asyncio.get_running_loop()
+    try:
+        paths = await loop.run_in_executor(_executor(), render_renditions, source_path)
+    except Exception as e:
+        # Not an image Pillow can read: keep the original only
+        print(f"Rendition failed for {filename}: {e}")
+        return {}
+
+    base_name = filename.rsplit('.', 1)[0]
+    try:
+        urls = await asyncio.gather(*[
+            store_file_async(path, f"{base_name}_{name}.webp", "image/webp",
+                             f"{file_type}_{name}", user_id, request_budget)
+            for name, path in paths.items()
+        ])
+        return dict(zip(paths, urls))
+    finally:
+        for path in paths.values():
+            os.unlink(path)
+
+
+async def upload_with_renditions(file: UploadFile, file_type: str, user_id: str,
+                                 request_budget: Optional[ByteBudget] = None) -> Tuple[str, Dict[str, str]]:
+    """Upload a photo along with its RENDITION_SIZES WebP renditions.
+    Returns (original URL, {rendition name: URL}). A photo whose content was
+    stored before reuses that object and its renditions without uploading."""
+    # One pass over the upload's spool: a named copy both the uploader and
+    # the worker process can read, and its content hash
+    source_path, content_hash, size = await asyncio.to_thread(spool_and_hash, file.file)
+    try:
+        stored = await run_in_db_executor(claim_stored_object, content_hash)
+        if stored is not None:
+            return stored
+
+        url, renditions = await asyncio.gather(
+            store_file_async(source_path, file.filename, file.content_type,
+                             file_type, user_id, request_budget),
+            _store_renditions(source_path, file.filename, file_type, user_id, request_budget),
+        )
+        return await run_in_db_executor(
+            record_stored_object, content_hash, url, file.content_type, size, renditions)
+    finally:
+        os.unlink(source_path)
+
+
+async def release_uploads(urls: Iterable[str]):
+    # Give back the references upload_with_renditions took for photos that
+    # did not end up saved on an asset
+    urls = list(urls)
+    if not urls:
+        return
+    try:
+        await run_in_db_executor(release_stored_objects, urls)
+    except Exception as e:
+        print(f"Releasing uploaded objects failed: {e}")
+
+
+async def gather_uploads(*uploads) -> List[Tuple[str, Dict[str, str]]]:
+    """Run upload_with_renditions calls concurrently. If one fails, the
+    references the others took are released before its error is raised."""
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await release_uploads(
+            result[0] for result in results if not isinstance(result, BaseException))
+        raise errors[0]
+    return results
@@ -0,0 +1,87 @@
+import hashlib
+import os
+from typing import Iterable, List
+
+import redis
+from dotenv import load_dotenv
+from sqlalchemy import select, and_
+from sqlalchemy.orm import Session
+
+from config.redis_client import redis_binary_client
+from models.match import Match, MatchStatus
+
+load_dotenv()
+
+# Per-user Bloom filter of every user id the user has acted on. The default
+# 2^17 bits (16 KiB) with 7 hashes keeps false positives near 1% at ~13k ids.
+SEEN_FILTER_BITS = int(os.getenv("SEEN_FILTER_BITS", 1 << 17))
+SEEN_FILTER_HASHES = int(os.getenv("SEEN_FILTER_HASHES", 7))
+SEEN_FILTER_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Only touch filters that already exist: a filter created by a single SETBIT
+# would look warm while missing everything recorded before it.
+_ADD_IF_EXISTS = redis_binary_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+end
+return 1
+""")
+
+
+def _key(user_id: str) -> str:
+    return f"seen:{user_id}"
+
+
+def _bit_positions(other_user_id: str) -> List[int]:
+    # Double hashing: k positions derived from two 64-bit halves of one digest
+    digest = hashlib.sha256(other_user_id.encode()).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:16], "big") | 1
+    return [(h1 + i * h2) % SEEN_FILTER_BITS for i in range(SEEN_FILTER_HASHES)]
+
+
+def _interacted_user_ids(db: Session, user_id: str) -> List[str]:
+    # Same exclusion rule as discovery: anything the user sent, and any
+    # active/rejected match the other user started
+    sent = select(Match.user2_id).where(Match.user1_id == user_id)
+    received = select(Match.user1_id).where(
+        and_(Match.user2_id == user_id, Match.status != MatchStatus.UNMATCHED))
+    return list(db.execute(sent.union_all(received)).scalars())
+
+
+def load_seen_filter(db: Session, user_id: str) -> bytes:
+    """Return the user's filter bitmap, building it from matches when cold."""
+    bitmap = redis_binary_client.get(_key(user_id))
+    if bitmap is not None:
+        return bitmap
+
+    bits = bytearray((SEEN_FILTER_BITS + 7) // 8)
+    for other_user_id in _interacted_user_ids(db, user_id):
+        for position in _bit_positions(other_user_id):
+            bits[position >> 3] |= 0x80 >> (position & 7)
+    # nx so a filter warmed (and updated) concurrently is never overwritten
+    redis_binary_client.set(_key(user_id), bytes(bits), ex=SEEN_FILTER_TTL_SECONDS, nx=True)
+    return bytes(bits)
+
+
+def might_have_seen(bitmap: bytes, other_user_id: str) -> bool:
+    # Redis bit offsets count from the most significant bit of each byte
+    return all(
+        position >> 3 < len(bitmap) and bitmap[position >> 3] & (0x80 >> (position & 7))
+        for position in _bit_positions(other_user_id)
+    )
+
+
+def add_seen(user_id: str, other_user_ids: Iterable[str]):
+    positions = [position for other_user_id in other_user_ids
+                 for position in _bit_positions(other_user_id)]
+    if not positions:
+        return
+    try:
+        _ADD_IF_EXISTS(keys=[_key(user_id)], args=positions)
+    except redis.RedisError as e:
+        # Best effort: discovery re-checks served ids against matches anyway
+        print(f"Seen filter update failed for user {user_id}: {e}")
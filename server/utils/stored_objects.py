@@ -0,0 +1,94 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Iterable, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from config.database import SessionLocal
+from models.stored_object import StoredObject
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def spool_and_hash(file: BinaryIO) -> Tuple[str, str, int]:
+    """Copy file to a named temp file, hashing it on the way.
+    Returns (path, hex SHA-256, size). Blocking: call from a worker thread."""
+    file.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-")
+    with os.fdopen(fd, "wb") as output:
+        while True:
+            chunk = file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            output.write(chunk)
+            size += len(chunk)
+    return path, digest.hexdigest(), size
+
+
+def claim_stored_object(content_hash: str) -> Optional[Tuple[str, dict]]:
+    """Take a reference to an already stored object with this content.
+    Returns its (url, renditions), or None when it was never stored."""
+    db = SessionLocal()
+    try:
+        row = db.execute(
+            update(StoredObject)
+            .where(StoredObject.content_hash == content_hash)
+            .values(ref_count=StoredObject.ref_count + 1, updated_at=func.now())
+            .returning(StoredObject.url, StoredObject.renditions)
+        ).first()
+        db.commit()
+        return (row.url, row.renditions or {}) if row else None
+    finally:
+        db.close()
+
+
+def record_stored_object(content_hash: str, url: str, content_type: str, size: int,
+                         renditions: dict) -> Tuple[str, dict]:
+    """Index a newly stored object, holding one reference. If the same content
+    was recorded concurrently, that object wins and is returned instead."""
+    db = SessionLocal()
+    try:
+        insert_stmt = insert(StoredObject).values(
+            content_hash=content_hash,
+            url=url,
+            content_type=content_type,
+            size=size,
+            renditions=renditions,
+            ref_count=1,
+        )
+        row = db.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=[StoredObject.content_hash],
+                set_={"ref_count": StoredObject.ref_count + 1, "updated_at": func.now()}
+            ).returning(StoredObject.url, StoredObject.renditions)
+        ).first()
+        db.commit()
+        if row.url != url:
+            print(f"Duplicate upload of {content_hash} stored as {url}; reusing {row.url}")
+        return row.url, row.renditions or {}
+    finally:
+        db.close()
+
+
+def release_stored_objects(urls: Iterable[str]):
+    # Drop one reference per URL no longer used by an asset. Objects left at
+    # zero stay stored, so a later upload of the same photo still reuses them.
+    urls = [url for url in urls if url]
+    if not urls:
+        return
+    db = SessionLocal()
+    try:
+        for url in urls:
+            db.execute(
+                update(StoredObject)
+                .where(StoredObject.url == url, StoredObject.ref_count > 0)
+                .values(ref_count=StoredObject.ref_count - 1, updated_at=func.now())
+            )
+        db.commit()
+    finally:
+        db.close()
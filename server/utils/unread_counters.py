@@ -0,0 +1,100 @@
+from typing import Dict, Tuple
+
+import redis
+from sqlalchemy import case, or_, select
+from sqlalchemy.orm import Session
+
+from config.redis_client import redis_client
+from models.conversation import Conversation
+
+# Marks a hash rebuilt from Postgres; writes alone never make it warm
+WARM_FIELD = "_warm"
+UNREAD_TTL_SECONDS = 24 * 60 * 60
+
+# Each sender's count is stored with the conversation's unread_version under
+# "v:<sender>", and a count only replaces one with an older version. Writes
+# after a commit and rebuilds from Postgres can then land in any order: the
+# newest value wins, and nothing is counted twice or lost.
+# ARGV: TTL, 1 to mark the hash warm, then (sender, version, count) triples.
+_MERGE_COUNTS = redis_client.register_script("""
+local created = redis.call('EXISTS', KEYS[1]) == 0
+for i = 3, #ARGV, 3 do
+    local version = tonumber(redis.call('HGET', KEYS[1], 'v:' .. ARGV[i]) or '-1')
+    if tonumber(ARGV[i + 1]) > version then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2], 'v:' .. ARGV[i], ARGV[i + 1])
+    end
+end
+if ARGV[2] == '1' then
+    redis.call('HSET', KEYS[1], '_warm', 1)
+end
+if created or ARGV[2] == '1' then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+""")
+
+
+def _key(user_id: str) -> str:
+    return f"unread:{user_id}"
+
+
+def _versioned_counts_from_db(db: Session, user_id: str) -> Dict[str, Tuple[int, int]]:
+    # Every conversation, read ones included, so their versions reach the cache
+    other_user_id = case(
+        (Conversation.user1_id == user_id, Conversation.user2_id),
+        else_=Conversation.user1_id
+    )
+    unread_count = case(
+        (Conversation.user1_id == user_id, Conversation.user1_unread_count),
+        else_=Conversation.user2_unread_count
+    )
+    rows = db.execute(
+        select(other_user_id, unread_count, Conversation.unread_version).where(
+            or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
+        )
+    ).all()
+    return {other_id: (count, version) for other_id, count, version in rows}
+
+
+def _merge(user_id: str, counts: Dict[str, Tuple[int, int]], warm: bool = False):
+    args = [UNREAD_TTL_SECONDS, int(warm)]
+    for sender_id, (count, version) in counts.items():
+        args += [sender_id, version, count]
+    _MERGE_COUNTS(keys=[_key(user_id)], args=args)
+
+
+def unread_counts(db: Session, user_id: str) -> Dict[str, int]:
+    """Unread messages per sender for user_id, rebuilt from Postgres when cold."""
+    try:
+        cached = redis_client.hgetall(_key(user_id))
+        if cached.pop(WARM_FIELD, None) is not None:
+            return {
+                sender_id: int(count) for sender_id, count in cached.items()
+                if not sender_id.startswith("v:") and int(count) > 0
+            }
+
+        versioned = _versioned_counts_from_db(db, user_id)
+        # Merged rather than replaced: a write that landed since the read
+        # above carries a newer version and is kept
+        _merge(user_id, versioned, warm=True)
+    except redis.RedisError as e:
+        print(f"Unread counter cache unavailable: {e}")
+        versioned = _versioned_counts_from_db(db, user_id)
+    return {sender_id: count for sender_id, (count, _) in versioned.items() if count}
+
+
+def set_unread(recipient_id: str, sender_id: str, count: int, version: int):
+    # count and version as returned by record_message/mark_read after commit
+    try:
+        _merge(recipient_id, {sender_id: (count, version)})
+    except redis.RedisError as e:
+        # Drop the cache so the next read recomputes from Postgres
+        print(f"Unread counter update failed: {e}")
+        _invalidate(recipient_id)
+
+
+def _invalidate(user_id: str):
+    try:
+        redis_client.delete(_key(user_id))
+    except redis.RedisError:
+        pass